@@ -0,0 +1,74 @@
+"""
+Micro-benchmark for page segmenting.
+
+Compares the old word-by-word segmenting loop from `extract_from_url`, which re-encodes the whole growing segment for
+every word, with `TokenChunker`. Run from the repository root:
+
+    python benchmarks/bench_chunker.py
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tiktoken
+from token_chunker import TokenChunker, get_encoding
+
+SEGMENT_MAX_TOKENS = 4095
+WORDS = ("research", "camping", "dispersed", "site", "the", "of", "Utah", "forest", "road", "permit", "water", "a",
+         "national", "area", "near", "trail", "allowed", "days", "rules", "and")
+
+
+def make_page(word_count: int) -> str:
+    rng = random.Random(word_count)
+    paragraphs = []
+    for start in range(0, word_count, 80):
+        words = [rng.choice(WORDS) for _ in range(min(80, word_count - start))]
+        paragraphs.append(" ".join(words) + ".")
+    return "\n\n".join(paragraphs)
+
+
+def word_loop_segments(text: str) -> list[str]:
+    """The previous segmenting loop, including the per-call encoder lookup."""
+    def count_tokens(string):
+        return len(tiktoken.encoding_for_model("gpt-4").encode(string))
+
+    segments = []
+    segment = ""
+    for word in text.split(" "):
+        tentative_segment = f"{segment} {word}"
+        if count_tokens(tentative_segment) <= SEGMENT_MAX_TOKENS:
+            segment = tentative_segment
+        else:
+            segments.append(segment)
+            segment = word
+    if segment:
+        segments.append(segment)
+    return segments
+
+
+def timed(func, *args) -> tuple[float, int]:
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, len(result)
+
+
+def _main():
+    get_encoding()
+    chunker = TokenChunker(SEGMENT_MAX_TOKENS, boundary="paragraph")
+    print(f"{'words':>8} {'word loop (s)':>14} {'chunker (s)':>12} {'segments':>9} {'chunker us/word':>16}")
+    for word_count in (1_000, 2_000, 4_000, 8_000, 16_000, 64_000, 256_000):
+        page = make_page(word_count)
+        if word_count <= 8_000:
+            loop_time, _ = timed(word_loop_segments, page)
+            loop_column = f"{loop_time:14.3f}"
+        else:
+            loop_column = f"{'skipped':>14}"
+        chunk_time, segments = timed(chunker.chunk, page)
+        print(f"{word_count:>8} {loop_column} {chunk_time:12.4f} {segments:>9} {chunk_time / word_count * 1e6:16.3f}")
+
+
+if __name__ == "__main__":
+    _main()
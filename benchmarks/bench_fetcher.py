@@ -0,0 +1,97 @@
+"""
+Fetch throughput against a local HTTP server.
+
+Serves a generated HTML page from a threaded keep-alive HTTP server on localhost, with a fixed delay per request to
+stand in for network latency, then fetches it many times:
+
+- one `requests.get` per URL with no shared session, the way `scrape_content_from_url` used to fetch pages
+- `PageFetcher.fetch_many` over one pooled client
+
+Run from the repository root:
+
+    python benchmarks/bench_fetcher.py --urls 200 --delay 0.05
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+from page_fetcher import PageFetcher, USER_AGENT
+
+PAGE = ("<html><body><h1>Benchmark</h1>" + "<p>Dispersed camping is allowed on most public land.</p>" * 200 +
+        "</body></html>").encode()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    delay = 0.0
+    connections = 0
+    lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        with Handler.lock:
+            Handler.connections += 1
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(PAGE)))
+        self.end_headers()
+        self.wfile.write(PAGE)
+
+    def log_message(self, *args):
+        pass
+
+
+def run_requests(urls: list[str]) -> int:
+    ok = 0
+    for url in urls:
+        response = requests.get(url, headers={'User-Agent': USER_AGENT}, timeout=20)
+        ok += response.status_code // 100 == 2
+    return ok
+
+
+def run_fetcher(urls: list[str], max_per_host: int) -> int:
+    fetcher = PageFetcher(max_per_host=max_per_host)
+    try:
+        return sum(status == "Success" for _, (_, status) in fetcher.fetch_many(urls))
+    finally:
+        fetcher.close()
+
+
+def measure(name: str, func, *args):
+    Handler.connections = 0
+    start = time.perf_counter()
+    ok = func(*args)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<28} {elapsed:8.2f}s {ok / elapsed:9.1f} pages/s {Handler.connections:6} connections")
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="Compare page fetch throughput against a local HTTP server.")
+    parser.add_argument("--urls", type=int, default=200, help="Number of pages to fetch")
+    parser.add_argument("--delay", type=float, default=0.05, help="Server delay per request in seconds")
+    parser.add_argument("--max-per-host", type=int, default=8, help="PageFetcher connections per host")
+    args = parser.parse_args()
+
+    Handler.delay = args.delay
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    urls = [f"http://127.0.0.1:{server.server_port}/page/{i}" for i in range(args.urls)]
+
+    try:
+        measure("requests.get, no session", run_requests, urls)
+        measure(f"PageFetcher, {args.max_per_host} per host", run_fetcher, urls, args.max_per_host)
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    _main()
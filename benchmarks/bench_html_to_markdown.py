@@ -0,0 +1,104 @@
+"""
+Compare the single-pass HTML to Markdown converter with the previous BeautifulSoup implementation.
+
+Converts every .html/.htm file in a corpus directory of saved pages with both converters and reports the conversion
+time and the token count of the output. Without a corpus, synthetic pages with nested lists, navigation and scripts are
+generated. Run from the repository root:
+
+    python benchmarks/bench_html_to_markdown.py --corpus saved_pages/
+"""
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup
+from html_markdown import html_to_markdown
+from token_chunker import count_tokens
+
+
+def legacy_html_to_markdown(html):
+    """The previous converter from web_research_agent, kept as the baseline."""
+    soup = BeautifulSoup(html, 'html.parser')
+    markdown_text = ""
+
+    for tag in soup.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'a', 'ul', 'ol', 'li', 'p', 'br']):
+        if tag.name in ('h1', 'h2', 'h3', 'h4', 'h5', 'h6'):
+            markdown_text += '{} {}\n'.format('#' * int(tag.name[1]), tag.text.replace('\n', ' ').strip())
+        elif tag.name == 'a':
+            markdown_text += '[{}]({})\n'.format(tag.text.replace('\n', ' ').strip(),
+                                                 tag.get('href', '').replace('\n', ' ').strip())
+        elif tag.name == 'ul':
+            for li in tag.find_all('li'):
+                markdown_text += '* {}\n'.format(li.text.replace('\n', ' ').strip())
+        elif tag.name == 'ol':
+            counter = 1
+            for li in tag.find_all('li'):
+                markdown_text += '{}. {}\n'.format(counter, li.text.replace('\n', ' ').strip())
+                counter += 1
+        elif tag.name == 'p':
+            markdown_text += '{}\n'.format(tag.text.replace('\n', ' ').strip())
+        elif tag.name == 'br':
+            markdown_text += '\n'
+        else:
+            markdown_text += tag.text.replace('\n', ' ').strip()
+
+        markdown_text = markdown_text.strip() + '\n\n'
+
+    markdown_text = re.sub(r' +', ' ', markdown_text)
+    return markdown_text
+
+
+def synthetic_page(sections: int, head_end: bool = True) -> str:
+    """A page of `sections` sections; without `head_end` the page leaves out </head>, as minified pages do."""
+    parts = ["<html><head><meta charset=utf-8><title>Camping</title><style>body { color: black; }</style>"
+             "<script>var tracking = 1;</script>" + ("</head>" if head_end else "") + "<body>",
+             "<nav><ul>" + "".join(f'<li><a href="/menu/{i}">Menu {i}</a></li>' for i in range(30)) + "</ul></nav>"]
+    for i in range(sections):
+        parts.append(f"<h2>Section {i}</h2><p>Dispersed camping is allowed <a href='/rules/{i}'>here</a> for up to "
+                     f"14 days.</p><ul><li>Site {i}<ul><li>Road access</li><li>No water</li></ul></li>"
+                     f"<li>Permit required</li></ul><script>render({i});</script>")
+    parts.append("</body></html>")
+    return "".join(parts)
+
+
+def load_corpus(path: str) -> list[tuple[str, str]]:
+    if not path:
+        return ([(f"synthetic-{n}", synthetic_page(n)) for n in (10, 100, 1000, 5000)] +
+                [("synthetic-10-no-head-end", synthetic_page(10, head_end=False))])
+    pages = []
+    for file_name in sorted(glob.glob(os.path.join(path, "*.htm*"))):
+        with open(file_name, encoding="utf-8", errors="replace") as file:
+            pages.append((os.path.basename(file_name), file.read()))
+    return pages
+
+
+def timed(func, html: str) -> tuple[float, str]:
+    start = time.perf_counter()
+    markdown = func(html)
+    return time.perf_counter() - start, markdown
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="Benchmark HTML to Markdown conversion.")
+    parser.add_argument("--corpus", default="", help="Directory of saved .html pages")
+    args = parser.parse_args()
+
+    totals = [0.0, 0.0, 0, 0]
+    print(f"{'page':<32} {'KB':>7} {'legacy s':>9} {'new s':>8} {'legacy tok':>11} {'new tok':>8}")
+    for name, html in load_corpus(args.corpus):
+        legacy_time, legacy_markdown = timed(legacy_html_to_markdown, html)
+        new_time, new_markdown = timed(html_to_markdown, html)
+        legacy_tokens, new_tokens = count_tokens(legacy_markdown), count_tokens(new_markdown)
+        totals = [totals[0] + legacy_time, totals[1] + new_time, totals[2] + legacy_tokens, totals[3] + new_tokens]
+        print(f"{name[:32]:<32} {len(html) / 1024:7.0f} {legacy_time:9.3f} {new_time:8.3f} "
+              f"{legacy_tokens:11} {new_tokens:8}")
+    print(f"{'total':<32} {'':>7} {totals[0]:9.3f} {totals[1]:8.3f} {totals[2]:11} {totals[3]:8}")
+
+
+if __name__ == "__main__":
+    _main()
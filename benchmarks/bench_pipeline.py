@@ -0,0 +1,158 @@
+"""
+Offline end-to-end benchmark of the research pipeline.
+
+Runs `web_search`, `execute_wikipedia_search` and `consolidate_results` from web_research_agent at several result
+counts with no network access: chat completions go to the mock server in `mock_openai.py` (run in its own process so
+its CPU time is not counted), DDGS is replaced by the fixture-backed fake in `fakes.py`, and result pages and the
+Wikipedia API are served from a local HTTP server. The LLM, page and Wikipedia caches are turned off so every run does
+the full work.
+
+For each stage and result count it reports wall time, CPU time of this process, LLM calls and tokens, and page
+fetches, and writes them to a JSON file so runs can be compared over time. Run from the repository root:
+
+    python benchmarks/bench_pipeline.py --counts 10 50 250 --latency 0.3
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+from datetime import datetime, timezone
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+import openai
+import web_research_agent
+from fakes import FakeDDGS, Fixtures, PageServer
+from mock_openai import serve
+from rate_limiter import RateLimiter
+from wiki_client import WikipediaClient
+
+QUESTION = "Where can I go dispersed camping in Utah, and what are the rules?"
+QUERY = "dispersed camping utah rules"
+
+
+def mock_stats(base_url: str) -> dict:
+    with urllib.request.urlopen(f"{base_url}/stats") as response:
+        return json.load(response)
+
+
+def reset_mock(base_url: str):
+    urllib.request.urlopen(urllib.request.Request(f"{base_url}/reset", data=b"", method="POST")).close()
+
+
+def run_stage(name: str, count: int, func, mock_url: str, page_server: PageServer) -> dict:
+    reset_mock(mock_url)
+    page_requests = page_server.requests
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    result = func()
+    wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+    stats = mock_stats(mock_url)
+    row = {
+        "stage": name,
+        "results": count,
+        "wall_seconds": round(wall, 3),
+        "cpu_seconds": round(cpu, 3),
+        "llm_calls": stats["calls"],
+        "llm_calls_by_model": stats["calls_by_model"],
+        "prompt_tokens": stats["prompt_tokens"],
+        "completion_tokens": stats["completion_tokens"],
+        "page_fetches": page_server.requests - page_requests,
+        "output_chars": len(result),
+    }
+    print(f"{name:<22} {count:>6} {wall:9.2f} {cpu:8.2f} {stats['calls']:7} "
+          f"{stats['prompt_tokens'] + stats['completion_tokens']:10} {row['page_fetches']:7}")
+    return row
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=BENCHMARKS_DIR).stdout.strip()
+    except OSError:
+        return ""
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="Benchmark the research pipeline offline.")
+    parser.add_argument("--counts", type=int, nargs="+", default=[10, 50, 250], help="Result counts to run")
+    parser.add_argument("--stages", nargs="+", default=["web_search", "wikipedia", "consolidate_results"],
+                        choices=["web_search", "wikipedia", "consolidate_results"])
+    parser.add_argument("--latency", type=float, default=0.3, help="Mock LLM seconds per call")
+    parser.add_argument("--latency-per-token", type=float, default=0.0, help="Mock LLM seconds per output token")
+    parser.add_argument("--completion-tokens", type=int, default=150, help="Mock LLM tokens of new text per reply")
+    parser.add_argument("--page-latency", type=float, default=0.05, help="Seconds per page fetch")
+    parser.add_argument("--search-latency", type=float, default=0.5, help="Seconds per DDGS or Wikipedia call")
+    parser.add_argument("--fixtures", default="", help="JSON fixtures file; generated when empty")
+    parser.add_argument("--save-fixtures", default="", help="Write the fixtures used to this JSON file")
+    parser.add_argument("--output", default="", help="JSON results file, default bench_results/pipeline-<time>.json")
+    args = parser.parse_args()
+
+    ready = multiprocessing.Queue()
+    mock = multiprocessing.Process(
+        target=serve, args=(0, args.latency, args.latency_per_token, args.completion_tokens, ready), daemon=True)
+    mock.start()
+    mock_url = f"http://127.0.0.1:{ready.get(timeout=30)}"
+    page_server = PageServer(latency=args.page_latency, api_latency=args.search_latency)
+
+    if args.fixtures:
+        fixtures = Fixtures.load(args.fixtures, page_server.base_url)
+    else:
+        fixtures = Fixtures.generate(max(args.counts), page_server.base_url)
+    page_server.pages = fixtures.pages
+    page_server.wiki_pages = fixtures.wiki_pages
+    if args.save_fixtures:
+        with open(args.save_fixtures, "w") as file:
+            file.write(fixtures.to_json(page_server.base_url))
+
+    openai.api_key = "mock"
+    openai.api_base = mock_url
+    FakeDDGS.fixtures = fixtures
+    FakeDDGS.latency = args.search_latency
+    web_research_agent.DDGS = FakeDDGS
+    web_research_agent.wiki_client = WikipediaClient(None, api_url=f"{page_server.base_url}/w/api.php")
+    web_research_agent.llm_cache = None
+    web_research_agent.page_fetcher.cache = None
+    web_research_agent.rate_limiter = RateLimiter()
+    options = web_research_agent.ResearchOptions()
+
+    stages = {
+        "web_search": lambda n: web_research_agent.web_search(QUESTION, QUERY, max_results=n, options=options),
+        "wikipedia": lambda n: web_research_agent.execute_wikipedia_search(QUESTION, QUERY, max_results=n,
+                                                                           options=options),
+        "consolidate_results": lambda n: web_research_agent.consolidate_results(
+            [dict(r) for r in fixtures.results[:n]], QUESTION, QUERY, options),
+    }
+
+    rows = []
+    try:
+        for count in args.counts:
+            for name in args.stages:
+                print(f"\n{'stage':<22} {'count':>6} {'wall s':>9} {'cpu s':>8} {'calls':>7} {'tokens':>10} "
+                      f"{'fetches':>7}")
+                rows.append(run_stage(name, count, lambda: stages[name](count), mock_url, page_server))
+    finally:
+        page_server.close()
+        mock.terminate()
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "revision": git_revision(),
+        "settings": vars(args),
+        "options": vars(options),
+        "runs": rows,
+    }
+    output = args.output or os.path.join("bench_results", f"pipeline-{int(time.time())}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"\nSaved {output}")
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,147 @@
+"""
+Fixture-backed fakes for the search backends and the web, used by the offline pipeline benchmark.
+
+`Fixtures` holds search results, Wikipedia pages and HTML pages, either generated deterministically or loaded from a
+JSON file with the same shape as `Fixtures.to_json`. Result URLs point at a local `PageServer`, so page fetches go
+through the real fetcher without leaving the machine. The page server also answers the MediaWiki API calls made by
+`wiki_client.WikipediaClient` from the fixture Wikipedia pages.
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+TOPICS = ["dispersed camping", "BLM land", "national forest", "Utah", "stay limit", "fire restrictions", "water",
+          "road access", "permits", "campsite etiquette", "Moab", "San Rafael Swell", "Dixie National Forest"]
+
+
+class Fixtures:
+    def __init__(self, results: list[dict], wiki_pages: dict, pages: dict):
+        self.results = results
+        self.wiki_pages = wiki_pages
+        self.pages = pages
+
+    @classmethod
+    def generate(cls, count: int = 250, base_url: str = "http://127.0.0.1", paragraphs: int = 40, seed: int = 7):
+        rng = random.Random(seed)
+        results = []
+        pages = {}
+        for i in range(count):
+            topic = rng.choice(TOPICS)
+            path = f"/page/{i}"
+            results.append({
+                "title": f"{topic.title()} guide {i}",
+                "href": f"{base_url}{path}",
+                "body": f"Everything about {topic} and {rng.choice(TOPICS)} in Utah, result {i}.",
+            })
+            body = "".join(
+                f"<h2>{rng.choice(TOPICS).title()}</h2><p>{' '.join(rng.choice(TOPICS) for _ in range(60))}.</p>"
+                f"<ul><li>{rng.choice(TOPICS)}</li><li>{rng.choice(TOPICS)}</li></ul>"
+                for _ in range(paragraphs))
+            pages[path] = f"<html><head><script>track()</script></head><body><nav>menu</nav>{body}</body></html>"
+        wiki_pages = {}
+        for topic in TOPICS:
+            path = f"/wiki/{topic.replace(' ', '_')}"
+            summary = f"{topic.title()} is " + " ".join(rng.choice(TOPICS) for _ in range(120)) + "."
+            wiki_pages[f"{topic.title()} (Wikipedia)"] = {"url": f"{base_url}{path}", "summary": summary}
+            pages[path] = f"<html><body><h1>{topic.title()}</h1><p>{summary}</p></body></html>"
+        return cls(results, wiki_pages, pages)
+
+    @classmethod
+    def load(cls, path: str, base_url: str):
+        with open(path) as file:
+            data = json.load(file)
+        results = [dict(r, href=r["href"].replace("{base_url}", base_url)) for r in data["results"]]
+        wiki_pages = {title: dict(page, url=page["url"].replace("{base_url}", base_url))
+                      for title, page in data["wiki_pages"].items()}
+        return cls(results, wiki_pages, data["pages"])
+
+    def to_json(self, base_url: str) -> str:
+        """Serialize the fixtures, with the page server address replaced by a {base_url} placeholder."""
+        results = [dict(r, href=r["href"].replace(base_url, "{base_url}")) for r in self.results]
+        wiki_pages = {title: dict(page, url=page["url"].replace(base_url, "{base_url}"))
+                      for title, page in self.wiki_pages.items()}
+        return json.dumps({"results": results, "wiki_pages": wiki_pages, "pages": self.pages}, indent=2)
+
+
+class FakeDDGS:
+    """Stands in for `duckduckgo_search.DDGS`, returning fixture results after a fixed latency."""
+    fixtures = None
+    latency = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def text(self, query, region=None, safesearch=None, max_results=None, backend=None):
+        time.sleep(self.latency)
+        return iter(self.fixtures.results[:max_results])
+
+
+class PageServer:
+    """
+    Serves fixture pages from a local keep-alive HTTP server, with an optional delay per request.
+
+    Requests to `/w/api.php` are answered like the MediaWiki search and page summary queries, from `wiki_pages`, after
+    `api_latency` seconds. They are counted in `api_requests` rather than `requests`.
+    """
+
+    def __init__(self, latency: float = 0.0, api_latency: float = 0.0):
+        self.pages = {}
+        self.wiki_pages = {}
+        self.latency = latency
+        self.api_latency = api_latency
+        self.requests = 0
+        self.api_requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                if parts.path == "/w/api.php":
+                    time.sleep(server.api_latency)
+                    server.api_requests += 1
+                    params = {k: v[0] for k, v in parse_qs(parts.query).items()}
+                    self._send(200, "application/json", json.dumps(server.wiki_reply(params)))
+                    return
+                time.sleep(server.latency)
+                server.requests += 1
+                page = server.pages.get(self.path)
+                self._send(200 if page is not None else 404, "text/html; charset=utf-8", page or "not found")
+
+            def _send(self, status: int, content_type: str, body: str):
+                data = body.encode()
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self._server.server_port}"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def wiki_reply(self, params: dict) -> dict:
+        if params.get("list") == "search":
+            titles = list(self.wiki_pages)[:int(params.get("srlimit", 10))]
+            return {"query": {"search": [{"title": title} for title in titles]}}
+        pages = []
+        for title in params.get("titles", "").split("|"):
+            page = self.wiki_pages.get(title)
+            if page is None:
+                pages.append({"title": title, "missing": True})
+            else:
+                pages.append({"title": title, "fullurl": page["url"], "extract": page["summary"]})
+        return {"query": {"pages": pages}}
+
+    def close(self):
+        self._server.shutdown()
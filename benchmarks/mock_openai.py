@@ -0,0 +1,186 @@
+"""
+A local stand-in for the OpenAI chat completion endpoint.
+
+Answers `POST /chat/completions` (and `/v1/chat/completions`) in the shape the openai client expects, after a
+configurable latency, with replies shaped for the prompts in web_research_agent:
+
+- batch relevance scoring prompts get a JSON object of scores, single scoring prompts a bare score
+- merge prompts echo their 'Current Response'/'Current Result' and append bullets, so shrink checks pass
+- every other prompt gets `completion_tokens` words of bullets
+
+Requests with `"stream": true` are answered as server-sent events, one chunk per word, with the first chunk after the
+latency and each later chunk after the per-token latency. Scores are derived from a hash of each result URL path, so
+runs are repeatable. `GET /stats` returns the call and token counters and `POST /reset` clears them. Run it on its own
+with:
+
+    python benchmarks/mock_openai.py --port 8900 --latency 0.5
+"""
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+RESULT_PATTERN = re.compile(r"Result ID: (\d+)\n\s*Title: .*\n\s*URL: (\S+)")
+SINGLE_URL_PATTERN = re.compile(r"URL: (\S+)")
+CURRENT_PATTERN = re.compile(r"Current (?:Response|Result):\n(.*?)\n\nNew (?:Page Segment|Result):", re.DOTALL)
+
+
+def url_score(url: str) -> int:
+    # Only the path is hashed, so scores do not change with the port the page server happens to get.
+    return hashlib.sha256(urlsplit(url).path.encode()).digest()[0] % 5
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class MockOpenAI:
+    """Reply generator and counters shared by the request handlers."""
+
+    def __init__(self, latency: float = 0.2, latency_per_token: float = 0.0, completion_tokens: int = 150):
+        self.latency = latency
+        self.latency_per_token = latency_per_token
+        self.completion_tokens = completion_tokens
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stats = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "calls_by_model": {}}
+
+    def complete(self, request: dict) -> dict:
+        prompt = "\n".join(m.get("content") or "" for m in request.get("messages", []))
+        content = self.reply(prompt)
+        completion_tokens = estimate_tokens(content)
+        time.sleep(self.latency + self.latency_per_token * completion_tokens)
+
+        model = request.get("model", "")
+        prompt_tokens = self.count(model, prompt, content)
+        return {
+            "id": f"chatcmpl-mock-{self.stats['calls']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    def stream(self, request: dict):
+        """Yield the chat completion chunks of a streamed reply, sleeping as the tokens would take to generate."""
+        prompt = "\n".join(m.get("content") or "" for m in request.get("messages", []))
+        content = self.reply(prompt)
+        model = request.get("model", "")
+        self.count(model, prompt, content)
+        time.sleep(self.latency)
+        words = re.findall(r"\S+\s*", content)
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(self.latency_per_token * estimate_tokens(word))
+            yield {"object": "chat.completion.chunk", "model": model,
+                   "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}]}
+        yield {"object": "chat.completion.chunk", "model": model,
+               "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+
+    def count(self, model: str, prompt: str, content: str) -> int:
+        """Count a call and its tokens, returning the prompt tokens."""
+        prompt_tokens = estimate_tokens(prompt)
+        with self.lock:
+            self.stats["calls"] += 1
+            self.stats["prompt_tokens"] += prompt_tokens
+            self.stats["completion_tokens"] += estimate_tokens(content)
+            self.stats["calls_by_model"][model] = self.stats["calls_by_model"].get(model, 0) + 1
+        return prompt_tokens
+
+    def reply(self, prompt: str) -> str:
+        if "Result ID:" in prompt:
+            return json.dumps({result_id: url_score(url) for result_id, url in RESULT_PATTERN.findall(prompt)})
+        if prompt.rstrip().endswith("Score:"):
+            match = SINGLE_URL_PATTERN.search(prompt)
+            return str(url_score(match.group(1) if match else prompt))
+        if "search query" in prompt or "query for Wikipedia" in prompt or "file name" in prompt:
+            return "dispersed camping utah"
+        bullets = " ".join(f"- mock detail {i}." for i in range(max(1, self.completion_tokens // 5)))
+        match = CURRENT_PATTERN.search(prompt)
+        if match and match.group(1).strip():
+            return f"{match.group(1).strip()}\n{bullets}"
+        return bullets
+
+
+def make_handler(mock: MockOpenAI):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/stats":
+                with mock.lock:
+                    self._send(200, json.loads(json.dumps(mock.stats)))
+            else:
+                self._send(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)) or 0)
+            if self.path.rstrip("/") == "/reset":
+                mock.reset()
+                self._send(200, {})
+            elif self.path.rstrip("/").endswith("/chat/completions"):
+                request = json.loads(body or b"{}")
+                if request.get("stream"):
+                    self._stream(mock.stream(request))
+                else:
+                    self._send(200, mock.complete(request))
+            else:
+                self._send(404, {"error": {"message": "not found"}})
+
+        def _send(self, status: int, payload: dict):
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _stream(self, chunks):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            for chunk in chunks:
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.close_connection = True
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def serve(port: int = 0, latency: float = 0.2, latency_per_token: float = 0.0, completion_tokens: int = 150,
+          ready=None):
+    """Serve until the process is stopped; `ready`, if given, receives the bound port."""
+    mock = MockOpenAI(latency, latency_per_token, completion_tokens)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(mock))
+    if ready is not None:
+        ready.put(server.server_port)
+    server.serve_forever()
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="Serve a mock OpenAI chat completion endpoint.")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds before every reply")
+    parser.add_argument("--latency-per-token", type=float, default=0.0, help="Extra seconds per completion token")
+    parser.add_argument("--completion-tokens", type=int, default=150, help="Approximate tokens of new text per reply")
+    args = parser.parse_args()
+    print(f"Mock OpenAI listening on http://127.0.0.1:{args.port}")
+    serve(args.port, args.latency, args.latency_per_token, args.completion_tokens)
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,74 @@
+import re
+from dedup import NearDuplicateIndex
+
+
+BULLET_MARKER = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s+")
+SOURCE_TAG = re.compile(r"\s*\[source: ([^\]]+)\]\s*$")
+
+
+def split_bullets(text: str) -> list[str]:
+    """Split a response into bullets without their markers; a line without a marker continues the bullet before it."""
+    bullets = []
+    for line in text.splitlines():
+        if not line.strip() or line.lstrip().startswith("#"):
+            continue
+        if BULLET_MARKER.match(line) or not bullets:
+            bullets.append(BULLET_MARKER.sub("", line).strip())
+        else:
+            bullets[-1] += " " + line.strip()
+    return [bullet for bullet in bullets if bullet]
+
+
+class BulletList:
+    """
+    An append-only answer made of bullets, each tagged with the source it came from.
+
+    A bullet whose text is a near duplicate of one already in the list is dropped, so merging never loses a bullet
+    from either side and never adds a repeat, and the answer can only grow: there is nothing to check for lost details
+    after a merge. `render` writes one "- text [source: url]" line per bullet, which `parse` reads back with the tags,
+    so answers can be passed around as text and merged again.
+
+    Example Usage:
+    >>> answer = BulletList()
+    >>> answer.add_text(extracted_text, url)
+    >>> answer.merge(BulletList.parse(other_answer))
+    >>> print(answer.render())
+    """
+
+    def __init__(self):
+        self.bullets = []
+        self._index = NearDuplicateIndex()
+
+    def __len__(self) -> int:
+        return len(self.bullets)
+
+    def add(self, text: str, source: str = "") -> bool:
+        """Add one bullet, returning False without adding it when it repeats a bullet already in the list."""
+        if not self._index.add(text):
+            return False
+        self.bullets.append((text, source))
+        return True
+
+    def add_text(self, text: str, source: str = "") -> int:
+        """Add every bullet of a response, tagged with `source` unless it has a tag. Returns how many were new."""
+        added = 0
+        for bullet in split_bullets(text):
+            tag = SOURCE_TAG.search(bullet)
+            if tag is not None:
+                added += self.add(bullet[:tag.start()], tag.group(1))
+            else:
+                added += self.add(bullet, source)
+        return added
+
+    def merge(self, other: "BulletList") -> int:
+        """Append the bullets of another list that this one does not have yet. Returns how many were new."""
+        return sum(self.add(text, source) for text, source in other.bullets)
+
+    def render(self) -> str:
+        return "\n".join(f"- {text} [source: {source}]" if source else f"- {text}" for text, source in self.bullets)
+
+    @classmethod
+    def parse(cls, text: str) -> "BulletList":
+        bullets = cls()
+        bullets.add_text(text)
+        return bullets
@@ -0,0 +1,120 @@
+import json
+from token_chunker import encode, get_encoding
+
+
+# Tokens every chat message costs beyond its text: the role and separator tokens.
+MESSAGE_OVERHEAD_TOKENS = 4
+# Tokens of a request outside its messages: the reply primer.
+REPLY_PRIMER_TOKENS = 3
+TRUNCATED_NOTE = "\n[output truncated]"
+
+
+class ConversationBuffer:
+    """
+    The history of a chat, kept small enough to send with every turn.
+
+    The token count of each message is taken once, when it is added, and a running total is kept, so fitting the
+    history to the window costs nothing per turn. `fit` returns the system message and as many of the latest turns as
+    fit in `max_tokens` less `reserve` tokens kept for the completion and the tokens of the function definitions. A
+    turn starts with a user message and holds the replies and function outputs that follow it; turns are dropped whole,
+    oldest first, and the latest turn is always kept. With `summarize`, a function from a list of messages to text, the
+    dropped turns are folded into a summary that is sent after the system message instead of being lost. The system
+    message is never dropped. Function outputs longer than `function_output_tokens` are cut to that length when they
+    are added.
+
+    Example Usage:
+    >>> history = ConversationBuffer(system_message, "gpt-3.5-turbo-16k-0613", max_tokens=16385, functions=FUNCTIONS)
+    >>> history.append({"role": "user", "content": text})
+    >>> completion = call_api(history.fit(), FUNCTIONS)
+    """
+
+    def __init__(self, system_message: dict, model_name: str, max_tokens: int, reserve: int = 1024,
+                 function_output_tokens: int = 1000, functions: list[dict] = None, summarize=None,
+                 summary_tokens: int = 500):
+        self.system_message = system_message
+        self.model_name = model_name
+        self.max_tokens = max_tokens
+        self.reserve = reserve
+        self.function_output_tokens = function_output_tokens
+        self.summarize = summarize
+        self.summary_tokens = summary_tokens
+        self.turns = []  # lists of (message, tokens)
+        self.total = 0
+        self.summary = None
+        self.summary_count = 0
+        self.dropped = 0
+        self._fixed = self.count(system_message) + REPLY_PRIMER_TOKENS
+        if functions:
+            self._fixed += len(encode(json.dumps(functions), model_name))
+
+    def count(self, message: dict) -> int:
+        """Tokens of one message, its role, name and function call included."""
+        text = message.get("content") or ""
+        if "name" in message:
+            text += message["name"]
+        if message.get("function_call"):
+            text += message["function_call"].get("name", "") + message["function_call"].get("arguments", "")
+        return len(encode(text, self.model_name)) + MESSAGE_OVERHEAD_TOKENS
+
+    def append(self, message: dict):
+        """Add a message; a user message starts a new turn."""
+        if message["role"] == "function":
+            message = dict(message, content=self.truncate(message.get("content") or "", self.function_output_tokens))
+        tokens = self.count(message)
+        if message["role"] == "user" or not self.turns:
+            self.turns.append([])
+        self.turns[-1].append((message, tokens))
+        self.total += tokens
+
+    def pop_turn(self) -> list[dict]:
+        """Remove the latest turn, such as one the model rejected as too long, and return its messages."""
+        if not self.turns:
+            return []
+        turn = self.turns.pop()
+        self.total -= sum(tokens for _, tokens in turn)
+        return [message for message, _ in turn]
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        ids = encode(text, self.model_name)
+        if len(ids) <= max_tokens:
+            return text
+        return get_encoding(self.model_name).decode(ids[:max_tokens]) + TRUNCATED_NOTE
+
+    @property
+    def room(self) -> int:
+        """Tokens the history may take up in a request."""
+        return self.max_tokens - self.reserve - self._fixed - self.summary_count
+
+    def fit(self) -> list[dict]:
+        """Drop or summarize the oldest turns until the history fits, and return the messages to send."""
+        while True:
+            evicted = self._evict()
+            if not evicted:
+                break
+            print(f"SYSTEM: dropped {len(evicted)} of the oldest messages to fit the context window")
+            if self.summarize is None:
+                break
+            # The new summary may be longer than the old one, so check the fit again.
+            self._summarize(evicted)
+
+        messages = [self.system_message]
+        if self.summary is not None:
+            messages.append(self.summary)
+        return messages + [message for turn in self.turns for message, _ in turn]
+
+    def _evict(self) -> list[dict]:
+        evicted = []
+        while len(self.turns) > 1 and self.total > self.room:
+            turn = self.turns.pop(0)
+            self.total -= sum(tokens for _, tokens in turn)
+            self.dropped += 1
+            evicted.extend(message for message, _ in turn)
+        return evicted
+
+    def _summarize(self, evicted: list[dict]):
+        """Fold dropped messages into the summary, which is kept within `summary_tokens`."""
+        if self.summary is not None:
+            evicted = [self.summary] + evicted
+        text = self.truncate(self.summarize(evicted), self.summary_tokens)
+        self.summary = {"role": "system", "content": f"Summary of the earlier conversation:\n{text}"}
+        self.summary_count = self.count(self.summary)
@@ -0,0 +1,120 @@
+import hashlib
+import re
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+
+TRACKING_PARAMS = {"fbclid", "gclid", "dclid", "msclkid", "mc_cid", "mc_eid", "igshid", "ref", "ref_src", "source",
+                   "spm", "_ga", "yclid"}
+MOBILE_HOST_PREFIXES = ("www.", "m.", "mobile.", "amp.")
+WORD_PATTERN = re.compile(r"\w+")
+SIMHASH_BITS = 64
+SIMHASH_BANDS = 4
+MAX_DISTANCE = 3
+
+
+def normalize_url(url: str) -> str:
+    """
+    Reduce a URL to a form shared by its copies.
+
+    The scheme is dropped, the host is lowercased and stripped of www/mobile/AMP prefixes (so en.m.wikipedia.org and
+    en.wikipedia.org match), tracking parameters and the fragment are removed, and the remaining parameters are sorted.
+    A prefix is only stripped when at least two labels are left, so amp.dev and m.tv keep their names.
+    """
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    if host.endswith(":80") or host.endswith(":443"):
+        host = host.rsplit(":", 1)[0]
+    labels = host.split(".")
+    while len(labels) > 2 and labels[0] + "." in MOBILE_HOST_PREFIXES:
+        labels.pop(0)
+    # An "m" label in the middle of the host, as in en.m.wikipedia.org, but not one of the last two labels.
+    labels = [label for i, label in enumerate(labels) if label != "m" or i == 0 or i >= len(labels) - 2]
+    host = ".".join(labels)
+    path = re.sub(r"/(amp/?)?$", "", parts.path) or "/"
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                   if not k.lower().startswith("utm_") and k.lower() not in TRACKING_PARAMS)
+    return urlunsplit(("", host, path, urlencode(query), ""))
+
+
+def simhash(text: str, shingle_size: int = 1) -> int:
+    """
+    64-bit SimHash of the word shingles of a text; near-identical texts differ in only a few bits.
+
+    Single words are the default shingle because search result snippets are too short for longer shingles to survive
+    a one-word edit.
+    """
+    words = WORD_PATTERN.findall(text.lower())
+    shingles = [" ".join(words[i:i + shingle_size]) for i in range(max(1, len(words) - shingle_size + 1))]
+    weights = [0] * SIMHASH_BITS
+    for shingle in shingles:
+        value = int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), "big")
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit in range(SIMHASH_BITS) if weights[bit] > 0)
+
+
+class NearDuplicateIndex:
+    """
+    Find texts whose SimHash is within `max_distance` bits of a text already added.
+
+    Hashes are split into bands; any two hashes within `max_distance` bits share at least one band whole, so only texts
+    in a matching band bucket are compared.
+    """
+
+    def __init__(self, max_distance: int = MAX_DISTANCE):
+        self.max_distance = max_distance
+        self.band_bits = SIMHASH_BITS // SIMHASH_BANDS
+        self.buckets = {}
+
+    def add(self, text: str) -> bool:
+        """Add a text, returning False without adding it when it is a near duplicate of an earlier one."""
+        value = simhash(text)
+        keys = [(band, value >> (band * self.band_bits) & ((1 << self.band_bits) - 1)) for band in range(SIMHASH_BANDS)]
+        for key in keys:
+            for other in self.buckets.get(key, ()):
+                if bin(value ^ other).count("1") <= self.max_distance:
+                    return False
+        for key in keys:
+            self.buckets.setdefault(key, []).append(value)
+        return True
+
+
+def dedupe_results(results: list[dict]) -> list[dict]:
+    """Drop search results whose normalized URL or body duplicates an earlier result, and report how many went."""
+    seen_urls = set()
+    index = NearDuplicateIndex()
+    kept = []
+    duplicate_urls = 0
+    duplicate_bodies = 0
+    for r in results:
+        url = normalize_url(r['href'])
+        if url in seen_urls:
+            duplicate_urls += 1
+            continue
+        if r.get('body', '').strip() and not index.add(f"{r.get('title', '')} {r['body']}"):
+            duplicate_bodies += 1
+            continue
+        seen_urls.add(url)
+        kept.append(r)
+    if len(kept) < len(results):
+        print(f"Deduplication collapsed {len(results) - len(kept)} of {len(results)} results "
+              f"({duplicate_urls} duplicate URLs, {duplicate_bodies} near-duplicate bodies)")
+    return kept
+
+
+def dedupe_texts(items: list, label: str = "segments", key=None) -> list:
+    """
+    Drop items whose text is a near duplicate of an earlier item's, keeping order, and report how many went.
+
+    Items are strings, or anything else when `key` returns the text of an item. Items with empty or blank text are
+    kept as they are, since they have nothing to compare.
+    """
+    index = NearDuplicateIndex()
+    kept = []
+    for item in items:
+        text = key(item) if key is not None else item
+        if not text or not text.strip() or index.add(text):
+            kept.append(item)
+    if len(kept) < len(items):
+        print(f"Deduplication collapsed {len(items) - len(kept)} of {len(items)} {label}")
+    return kept
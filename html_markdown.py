@@ -0,0 +1,157 @@
+from html.parser import HTMLParser
+
+
+SKIPPED_TAGS = {'script', 'style', 'nav', 'noscript', 'template', 'head', 'svg', 'iframe'}
+# Tags allowed in <head>; any other start tag, such as <body>, ends a head whose end tag was left out.
+HEAD_TAGS = {'title', 'meta', 'link', 'base', 'style', 'script', 'noscript', 'template'}
+HEADING_TAGS = {'h1': '# ', 'h2': '## ', 'h3': '### ', 'h4': '#### ', 'h5': '##### ', 'h6': '###### '}
+BLOCK_TAGS = {'p', 'div', 'section', 'article', 'main', 'header', 'footer', 'aside', 'blockquote', 'table', 'tr',
+              'dl', 'dt', 'dd', 'figure', 'figcaption', 'form', 'fieldset', 'address', 'hr', 'ul', 'ol'}
+LIST_TAGS = {'ul', 'ol'}
+CELL_TAGS = {'td', 'th'}
+
+
+class MarkdownConverter(HTMLParser):
+    """
+    Convert HTML to Markdown in a single pass over the document.
+
+    Tags are handled in document order as the parser reaches them, so nested elements are written exactly once, and
+    the text of `script`, `style`, `nav` and similar tags is dropped. Skipped tags are kept on a stack, and the `head`
+    ends at the first tag that cannot be in it, since pages may leave out `</head>`. Output is written to a list of strings. HTML can be
+    fed in pieces, and `read()` drains the Markdown produced so far, which keeps memory bounded by the current block
+    of text rather than the whole document.
+
+    Example Usage:
+    >>> converter = MarkdownConverter()
+    >>> for chunk in response_chunks:
+    >>>     converter.feed(chunk)
+    >>>     out.write(converter.read())
+    >>> converter.close()
+    >>> out.write(converter.read())
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._output = []
+        self._line = []
+        self._prefix = ""
+        self._skipped = []
+        self._pre_depth = 0
+        self._lists = []
+        self._list_written = False
+        self._links = []
+
+    def read(self) -> str:
+        """Return the Markdown produced since the last call."""
+        text = "".join(self._output)
+        self._output = []
+        return text
+
+    def close(self):
+        super().close()
+        self._flush()
+
+    def handle_starttag(self, tag, attrs):
+        if 'head' in self._skipped and tag not in HEAD_TAGS:
+            del self._skipped[self._skipped.index('head'):]
+        if tag in SKIPPED_TAGS:
+            self._skipped.append(tag)
+            return
+        if self._skipped:
+            return
+
+        if tag in HEADING_TAGS:
+            self._flush()
+            self._prefix = HEADING_TAGS[tag]
+        elif tag == 'li':
+            self._flush()
+            self._prefix = self._list_prefix()
+        elif tag in LIST_TAGS:
+            self._flush(separator="\n")
+            self._lists.append([tag, 0])
+        elif tag == 'pre':
+            self._flush()
+            self._pre_depth += 1
+            self._output.append("```\n")
+        elif tag in BLOCK_TAGS:
+            self._flush()
+        elif tag == 'br':
+            self._flush(separator="\n")
+        elif tag == 'a':
+            self._links.append((dict(attrs).get('href') or "", len(self._line)))
+        elif tag in CELL_TAGS:
+            self._line.append(" ")
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in ('br', 'hr'):
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            if tag in self._skipped:
+                # Close the innermost open tag of this name, with any skipped tags left open inside it.
+                del self._skipped[len(self._skipped) - 1 - self._skipped[::-1].index(tag):]
+            return
+        if self._skipped:
+            return
+
+        if tag in HEADING_TAGS or tag == 'li':
+            self._flush(separator="\n" if tag == 'li' else "\n\n")
+            self._prefix = ""
+        elif tag in LIST_TAGS:
+            self._flush(separator="\n")
+            if self._lists:
+                self._lists.pop()
+            if not self._lists and self._list_written:
+                self._output.append("\n")
+                self._list_written = False
+        elif tag == 'pre':
+            self._pre_depth = max(0, self._pre_depth - 1)
+            self._output.append("".join(self._line).strip("\n") + "\n```\n\n")
+            self._line = []
+        elif tag in BLOCK_TAGS:
+            self._flush()
+        elif tag == 'a' and self._links:
+            href, start = self._links.pop()
+            text = " ".join("".join(self._line[start:]).split())
+            href = href.strip()
+            if text and href and not href.startswith(('#', 'javascript:')):
+                self._line[start:] = [f"[{text}]({href})"]
+        elif tag in CELL_TAGS:
+            self._line.append(" |")
+
+    def handle_data(self, data):
+        if not self._skipped:
+            self._line.append(data)
+
+    def _list_prefix(self) -> str:
+        if not self._lists:
+            return "* "
+        self._lists[-1][1] += 1
+        tag, counter = self._lists[-1]
+        indent = "  " * (len(self._lists) - 1)
+        return f"{indent}{counter}. " if tag == 'ol' else f"{indent}* "
+
+    def _flush(self, separator: str = "\n\n"):
+        """Write out the text gathered for the current block, with whitespace collapsed."""
+        if self._pre_depth:
+            return
+        text = " ".join("".join(self._line).split())
+        self._line = []
+        self._links = []
+        if not text:
+            return
+        if self._lists:
+            separator = "\n"
+            self._list_written = True
+        self._output.append(f"{self._prefix}{text}{separator}")
+        self._prefix = ""
+
+
+def html_to_markdown(html: str) -> str:
+    """Convert an HTML document to Markdown text."""
+    converter = MarkdownConverter()
+    converter.feed(html)
+    converter.close()
+    return converter.read()
@@ -0,0 +1,71 @@
+import math
+import re
+from collections import Counter, defaultdict
+
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "how", "i", "in", "is", "it",
+    "of", "on", "or", "that", "the", "this", "to", "was", "what", "when", "where", "which", "who", "why", "will",
+    "with", "you", "your", "www", "http", "https", "com", "org", "html",
+}
+TITLE_WEIGHT = 2
+
+
+def tokenize(text: str) -> list[str]:
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    An Okapi BM25 index over a batch of search results.
+
+    The title, URL and body of each result are indexed as one document, with title terms counted `TITLE_WEIGHT` times.
+    Postings are built once, so scoring a query only touches the documents that contain its terms.
+    """
+
+    def __init__(self, results: list[dict], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)
+        self.lengths = []
+        for doc_id, r in enumerate(results):
+            terms = tokenize(r.get('title', '')) * TITLE_WEIGHT + tokenize(r.get('href', '')) + \
+                tokenize(r.get('body', ''))
+            self.lengths.append(len(terms))
+            for term, frequency in Counter(terms).items():
+                self.postings[term].append((doc_id, frequency))
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0
+
+    def scores(self, query: str) -> list[float]:
+        """Return the BM25 score of every document for the query, in document order."""
+        scores = [0.0] * len(self.lengths)
+        count = len(self.lengths)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, frequency in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[doc_id] / self.average_length)
+                scores[doc_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return scores
+
+
+def rank_results(question: str, results: list[dict], top_k: int = 0, min_score: float = 0.0,
+                 keep_order: bool = True) -> list[dict]:
+    """
+    Keep the search results that rank best against the question, in their original order, or best first when
+    `keep_order` is False.
+
+    `top_k` keeps at most that many results, 0 for no limit. `min_score` drops results that score below that fraction
+    of the best score, so 0.2 keeps results scoring at least a fifth of the best match.
+    """
+    if not results:
+        return []
+    scores = BM25Index(results).scores(question)
+    cutoff = max(scores) * min_score
+    ranked = sorted((i for i in range(len(results)) if scores[i] >= cutoff), key=lambda i: -scores[i])
+    if top_k > 0:
+        ranked = ranked[:top_k]
+    return [results[i] for i in (sorted(ranked) if keep_order else ranked)]
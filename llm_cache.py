@@ -0,0 +1,103 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def cache_key(model_name: str, msgs: list[dict], functions: list[dict] = None) -> str:
+    """Hash a chat completion request; identical model, messages and functions give the same key."""
+    request = json.dumps({"model": model_name, "messages": msgs, "functions": functions},
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(request.encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    A persistent cache of non-streaming chat completion responses, stored in a SQLite file.
+
+    Responses are keyed by `cache_key` and stored as JSON. Entries older than `ttl` seconds are treated as missing and
+    replaced on the next store. When the stored responses grow past `max_bytes` or `max_entries`, the least recently
+    used entries are evicted. Hits, misses and the tokens the hits would have cost are counted for the life of the
+    object.
+
+    Example Usage:
+    >>> cache = ResponseCache(".cache/llm.sqlite")
+    >>> key = cache_key(model_name, msgs)
+    >>> completion = cache.get(key)
+    >>> if completion is None:
+    >>>     completion = openai.ChatCompletion.create(model=model_name, messages=msgs)
+    >>>     cache.put(key, completion)
+    """
+
+    def __init__(self, path: str, ttl: float = 7 * 86400, max_bytes: int = 64 * 1024 * 1024,
+                 max_entries: int = 100000):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.tokens_saved = 0
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def get(self, key: str) -> dict:
+        """Return the cached response for a key, or None when it is missing or expired."""
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or time.time() - row[1] >= self.ttl:
+                self.misses += 1
+                return None
+            self._connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self._connection.commit()
+            response = json.loads(row[0])
+            self.hits += 1
+            self.tokens_saved += response.get("usage", {}).get("total_tokens", 0)
+        return response
+
+    def put(self, key: str, response: dict):
+        """Store a response, then evict the least recently used responses until the cache is within its limits."""
+        data = json.dumps(response)
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created_at, accessed_at, size) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, data, now, now, len(data.encode())))
+            count, total = connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            if count > self.max_entries or total > self.max_bytes:
+                for evict_key, evict_size in connection.execute(
+                        "SELECT key, size FROM responses ORDER BY accessed_at ASC").fetchall():
+                    if count <= self.max_entries and total <= self.max_bytes:
+                        break
+                    connection.execute("DELETE FROM responses WHERE key = ?", (evict_key,))
+                    count -= 1
+                    total -= evict_size
+            connection.commit()
+
+    def delete(self, key: str):
+        """Remove a response, such as one the caller rejected, so the next identical request goes to the API."""
+        with self._lock:
+            self._connect().execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._connection.commit()
+
+    def report(self) -> str:
+        return f"LLM cache: {self.hits} hits, {self.misses} misses, {self.tokens_saved} tokens saved"
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT, created_at REAL, "
+                "accessed_at REAL, size INTEGER)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+            self._connection.commit()
+        return self._connection
@@ -1,16 +1,25 @@
 import json
+import os
 from datetime import datetime
 from time import sleep
 import pytz
 import openai
-import tiktoken
 from duckduckgo_search import DDGS
-import wikipedia
+from conversation_buffer import ConversationBuffer
+from token_chunker import count_tokens
+from tool_dispatcher import ToolDispatcher
+from wiki_client import WikipediaClient
 
 
 TIMEZONE = 'America/Denver'
 MODEL_NAME = "gpt-3.5-turbo-16k-0613"
 MODEL_MAX_TOKENS = 16385
+COMPLETION_RESERVE_TOKENS = int(os.getenv("COMPLETION_RESERVE_TOKENS", "1024"))
+FUNCTION_OUTPUT_MAX_TOKENS = int(os.getenv("FUNCTION_OUTPUT_MAX_TOKENS", "1000"))
+SUMMARIZE_HISTORY = bool(os.getenv("SUMMARIZE_HISTORY", ""))
+TOOL_TIMEOUT = float(os.getenv("TOOL_TIMEOUT", "60"))
+TOOL_CACHE_TTL = float(os.getenv("TOOL_CACHE_TTL", "600"))
+CACHE_DIR = os.getenv("CACHE_DIR", ".cache")
 FUNCTIONS = [
     {
         "name": "web_search",
@@ -42,21 +51,24 @@ FUNCTIONS = [
     },
 ]
 
+wiki_client = WikipediaClient(
+    os.path.join(CACHE_DIR, "wikipedia.sqlite"),
+    max_workers=int(os.getenv("WIKI_MAX_CONNECTIONS", "4")),
+)
+tools = ToolDispatcher(max_workers=int(os.getenv("TOOL_WORKERS", "4")), timeout=TOOL_TIMEOUT, ttl=TOOL_CACHE_TTL)
+
 
 def token_count(string: str) -> int:
     """Returns the number of tokens in a text string."""
-    encoding = tiktoken.encoding_for_model(MODEL_NAME)
-    return len(encoding.encode(string))
+    return count_tokens(string, MODEL_NAME)
 
 
 def wikipedia_search(query: str, max_tokens: int) -> str:
     results = ""
     total_count = 0
-    for page_title in wikipedia.search(query[:300]):
-
-        try:
-            wiki_page = wikipedia.page(title=page_title, auto_suggest=False)
-        except (wikipedia.exceptions.PageError,wikipedia.exceptions.DisambiguationError):
+    pages = wiki_client.summaries(wiki_client.search(query[:300]))
+    for page_title, wiki_page in pages.items():
+        if wiki_page is None:
             continue
 
         result = f"\nTITLE: {page_title}\nURL: {wiki_page.url}\n{wiki_page.summary}\n"
@@ -81,7 +93,30 @@ def web_search(query: str, max_tokens: int) -> str:
     return results
 
 
+tools.register("web_search", lambda query, **_: web_search(query, FUNCTION_OUTPUT_MAX_TOKENS))
+tools.register("wikipedia_search", lambda query, **_: wikipedia_search(query, FUNCTION_OUTPUT_MAX_TOKENS))
+
+
+def summarize_messages(msgs: list[dict]) -> str:
+    """Summarize the messages dropped from the conversation history, so the assistant keeps their gist."""
+    transcript = "\n".join(f"{m['role'].upper()}: {m.get('content') or ''}" for m in msgs)
+    completion = call_api([{
+        "role": "system",
+        "content": f"""Summarize this conversation in a short paragraph. Keep the facts, names, numbers and decisions 
+that later questions may refer to.
+
+{transcript}"""
+    }], stream=False)
+    return completion["choices"][0]["message"]["content"]
+
+
 def call_api(msgs: list[dict], functions: list[dict] = None, stream: bool = True):
+    """
+    Send a chat completion request, retrying on errors with exponential backoff.
+
+    A request over the model's context length is not retried, since sending it again cannot help; the caller drops the
+    turn that made it too long.
+    """
     max_retry = 7
     retry = 0
     while True:
@@ -98,9 +133,7 @@ def call_api(msgs: list[dict], functions: list[dict] = None, stream: bool = True
         except Exception as api_err:
             print(f'\n\nError communicating with OpenAI: "{api_err}"')
             if 'maximum context length' in str(api_err):
-                msgs = msgs.pop(0)
-                print('\n\n DEBUG: Trimming oldest message')
-                continue
+                raise api_err
             retry += 1
             if retry >= max_retry:
                 raise api_err
@@ -120,7 +153,9 @@ Ask for clarification if a user request is ambiguous.
 Current Date: {local_time.strftime('%Y-%m-%d %H:%M:%S %Z%z')}
     """}
 
-    messages = []
+    history = ConversationBuffer(system_message, MODEL_NAME, MODEL_MAX_TOKENS, reserve=COMPLETION_RESERVE_TOKENS,
+                                 function_output_tokens=FUNCTION_OUTPUT_MAX_TOKENS, functions=FUNCTIONS,
+                                 summarize=summarize_messages if SUMMARIZE_HISTORY else None)
     function_name = ""
     while True:
 
@@ -128,9 +163,19 @@ Current Date: {local_time.strftime('%Y-%m-%d %H:%M:%S %Z%z')}
             text = input('\nUSER: ')
             if text == '':
                 continue
-            messages.append({"role": "user", "content": text})
+            history.append({"role": "user", "content": text})
 
-        completion = call_api([system_message] + messages, FUNCTIONS, True)
+        try:
+            completion = call_api(history.fit(), FUNCTIONS, True)
+        except Exception as err:
+            if 'maximum context length' not in str(err):
+                raise
+            # The latest turn is always kept by fit(), so a message too long for the window would fail every time.
+            history.pop_turn()
+            print("SYSTEM: that message does not fit in the model's context window and was dropped, "
+                  "please try a shorter one")
+            function_name = ""
+            continue
         response_text = ""
         function_name = ""
         first_line = True
@@ -144,6 +189,8 @@ Current Date: {local_time.strftime('%Y-%m-%d %H:%M:%S %Z%z')}
                     function_name = chunk.choices[0].delta.function_call.name
                 response_text = response_text + \
                     chunk.choices[0].delta.function_call.arguments
+                # Start the search as soon as the arguments are complete, before the stream finishes.
+                tools.start_partial(function_name, response_text)
             if "content" in chunk.choices[0].delta and chunk.choices[0].delta.content:
                 response_text = response_text + chunk.choices[0].delta.content
                 if first_line:
@@ -156,17 +203,18 @@ Current Date: {local_time.strftime('%Y-%m-%d %H:%M:%S %Z%z')}
                 first_line = False
 
         if function_name == "":
-            messages.append({"role": "assistant", "content": response_text})
+            history.append({"role": "assistant", "content": response_text})
         else:
-            params = json.loads(response_text)
-            if function_name == "web_search":
-                print(f"SYSTEM: searching for '{params['query']}'")
-                output = web_search(params['query'], 1000)
-            if function_name == "wikipedia_search":
-                print(f"SYSTEM: searching for '{params['query']}'")
-                output = wikipedia_search(params['query'], 1000)
-            else:
-                raise Exception(f"invalid function name {function_name}")
-
-            messages.append(
+            history.append({"role": "assistant", "content": None,
+                            "function_call": {"name": function_name, "arguments": response_text}})
+            try:
+                params = json.loads(response_text)
+                print(f"SYSTEM: searching for '{params.get('query', '')}'")
+                output = tools.call(function_name, params)
+            except Exception as err:
+                # Let the model see what went wrong and answer or try again, instead of ending the session.
+                print(f"SYSTEM: {function_name} failed: {err}")
+                output = f"Error: {err}"
+
+            history.append(
                 {"role": "function", "name": function_name, "content": output})
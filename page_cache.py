@@ -0,0 +1,122 @@
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+
+
+@dataclass
+class CachedPage:
+    url: str
+    html: str
+    markdown: str
+    etag: str
+    last_modified: str
+    fetched_at: float
+
+    def is_fresh(self, ttl: float) -> bool:
+        return time.time() - self.fetched_at < ttl
+
+    def validators(self) -> dict:
+        """Conditional request headers that let the server answer 304 Not Modified for this page."""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class PageCache:
+    """
+    A persistent cache of downloaded pages, keyed by URL and stored in a SQLite file.
+
+    Each entry holds the raw HTML, the converted markdown, and the ETag and Last-Modified validators from the response.
+    Entries younger than `ttl` seconds are served as is; older entries are revalidated with a conditional request, or
+    fetched again when the server sent no validators. When the stored pages grow past `max_bytes`, the least recently
+    used entries are evicted. Hit and miss counts cover the life of the object.
+
+    Example Usage:
+    >>> cache = PageCache(".cache/pages.sqlite", ttl=86400)
+    >>> page = cache.get("http://www.example.com")
+    >>> if page is not None and page.is_fresh(cache.ttl):
+    >>>     print(page.markdown)
+    """
+
+    def __init__(self, path: str, ttl: float = 86400, max_bytes: int = 256 * 1024 * 1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def get(self, url: str) -> CachedPage:
+        """Return the cached page for a URL, fresh or not, or None."""
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT url, html, markdown, etag, last_modified, fetched_at FROM pages WHERE url = ?",
+                (url,)).fetchone()
+            if row is None:
+                return None
+            self._connection.execute("UPDATE pages SET accessed_at = ? WHERE url = ?", (time.time(), url))
+            self._connection.commit()
+        return CachedPage(*row)
+
+    def put(self, url: str, html: str, markdown: str, etag: str = "", last_modified: str = ""):
+        """Store a page, then evict the least recently used pages until the cache is under `max_bytes`."""
+        now = time.time()
+        size = len(html.encode()) + len(markdown.encode())
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO pages (url, html, markdown, etag, last_modified, fetched_at, accessed_at, size) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, html, markdown, etag or "", last_modified or "", now, now, size))
+            total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+            if total > self.max_bytes:
+                evicted = 0
+                for evict_url, evict_size in connection.execute(
+                        "SELECT url, size FROM pages ORDER BY accessed_at ASC").fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    connection.execute("DELETE FROM pages WHERE url = ?", (evict_url,))
+                    total -= evict_size
+                    evicted += 1
+                print(f"Page cache evicted {evicted} pages")
+            connection.commit()
+
+    def refresh(self, url: str):
+        """Mark a cached page as fetched now, after the server confirmed it has not changed."""
+        with self._lock:
+            self._connect().execute("UPDATE pages SET fetched_at = ? WHERE url = ?", (time.time(), url))
+            self._connection.commit()
+
+    def record(self, outcome: str):
+        """Count a lookup as a "hit", "revalidated" hit, or "miss"."""
+        with self._lock:
+            if outcome == "hit":
+                self.hits += 1
+            elif outcome == "revalidated":
+                self.hits += 1
+                self.revalidated += 1
+            else:
+                self.misses += 1
+
+    def report(self) -> str:
+        return f"Page cache: {self.hits} hits ({self.revalidated} revalidated), {self.misses} misses"
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY, html TEXT, markdown TEXT, etag TEXT, "
+                "last_modified TEXT, fetched_at REAL, accessed_at REAL, size INTEGER)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS pages_accessed_at ON pages (accessed_at)")
+            self._connection.commit()
+        return self._connection
@@ -0,0 +1,232 @@
+import asyncio
+import atexit
+import codecs
+import re
+import threading
+from collections import namedtuple
+from concurrent.futures import as_completed
+import aiohttp
+
+
+USER_AGENT = "Mozilla/5.0 (Android 13; Mobile; rv:109.0) Gecko/118.0 Firefox/118.0"
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml", "text/plain")
+META_CHARSET_PATTERN = re.compile(rb'<meta[^>]+charset=["\']?([A-Za-z0-9_.:-]+)', re.IGNORECASE)
+CHUNK_SIZE = 64 * 1024
+
+# A finished download. `html` is the decoded body of a new download, and None for cached pages and failures.
+# `truncated` is True when the body was cut short by the byte or token limit.
+Download = namedtuple("Download", ["text", "status", "html", "etag", "last_modified", "truncated"],
+                      defaults=[False])
+
+
+class PageFetcher:
+    """
+    Fetch web pages over one pooled, keep-alive HTTP client.
+
+    The client runs on an asyncio event loop in a background thread, so it can be shared by any number of worker
+    threads through `fetch` and `fetch_many`, or awaited directly from async code with `fetch_async` and
+    `fetch_many_async`. Connections are reused between requests to the same host, and no more than `max_connections`
+    connections are open at once, with no more than `max_per_host` to a single host.
+
+    Results keep the `(text, status)` shape of `scrape_content_from_url`: status is "Success" or an error message, and
+    text is empty on failure. Bodies are read as a stream. A response whose Content-Type is not one of `content_types`
+    is dropped before its body is read, and no more than `max_bytes` of a body are read. The body is decoded once, with
+    the charset from the Content-Type header or a `<meta charset>` tag, and fed to a `converter` as it arrives; a
+    converter is a class like `html_markdown.MarkdownConverter` with `feed`, `read` and `close` methods. When a
+    `token_counter` is given, a fetch can pass `max_tokens` to stop reading once that many tokens of text are out.
+
+    With a `cache` (see `page_cache.PageCache`), fresh cached pages are returned without a request, stale pages are
+    revalidated with their ETag and Last-Modified validators, and new pages are stored with their HTML and converted
+    text. Pages cut short by `max_bytes` or `max_tokens` are not cached, so a later fetch with a higher limit gets the
+    whole page. Set `cache` to None to bypass it.
+
+    Decoding, conversion, token counting and cache lookups run on the event loop's default executor rather than on the
+    loop itself, so parsing one large page does not hold up every other download.
+
+    Example Usage:
+    >>> fetcher = PageFetcher(converter=MarkdownConverter)
+    >>> for url, (text, status) in fetcher.fetch_many(urls):
+    >>>     print(url, status)
+    """
+
+    def __init__(self, max_connections: int = 32, max_per_host: int = 4, timeout: float = 20,
+                 keepalive_timeout: float = 30, converter=None, cache=None, max_bytes: int = 4 * 1024 * 1024,
+                 content_types: tuple = HTML_CONTENT_TYPES, token_counter=None):
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.keepalive_timeout = keepalive_timeout
+        self.converter = converter
+        self.cache = cache
+        self.max_bytes = max_bytes
+        self.content_types = content_types
+        self.token_counter = token_counter
+        self._lock = threading.Lock()
+        self._loop = None
+        self._session = None
+
+    def fetch(self, url: str, max_tokens: int = None) -> (str, str):
+        """Fetch one page, blocking the calling thread until it is done."""
+        download = asyncio.run_coroutine_threadsafe(self._get(url, max_tokens), self._start()).result()
+        return self._finish(url, download)
+
+    def fetch_many(self, urls: list[str], max_tokens: int = None):
+        """Fetch pages concurrently, yielding `(url, (text, status))` in the order the downloads finish."""
+        loop = self._start()
+        futures = {asyncio.run_coroutine_threadsafe(self._get(url, max_tokens), loop): url for url in urls}
+        for future in as_completed(futures):
+            yield futures[future], self._finish(futures[future], future.result())
+
+    async def fetch_async(self, url: str, max_tokens: int = None) -> (str, str):
+        """Fetch one page from async code running on any event loop."""
+        download = await asyncio.wrap_future(
+            asyncio.run_coroutine_threadsafe(self._get(url, max_tokens), self._start()))
+        if download.html is None or self.cache is None or download.truncated:
+            return download.text, download.status
+        return await asyncio.get_running_loop().run_in_executor(None, self._finish, url, download)
+
+    async def fetch_many_async(self, urls: list[str], max_tokens: int = None):
+        """Async generator over `(url, (text, status))`, in the order the downloads finish."""
+        async def fetch(url):
+            return url, await self.fetch_async(url, max_tokens)
+
+        for task in asyncio.as_completed([fetch(url) for url in urls]):
+            yield await task
+
+    def close(self):
+        """Close the pooled connections and stop the background event loop."""
+        with self._lock:
+            loop, session = self._loop, self._session
+            self._loop = None
+            self._session = None
+        if loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(session.close(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+
+    def _start(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="page-fetcher", daemon=True).start()
+                self._session = asyncio.run_coroutine_threadsafe(self._open_session(), loop).result()
+                self._loop = loop
+                atexit.register(self.close)
+            return self._loop
+
+    async def _open_session(self) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit=self.max_connections,
+            limit_per_host=self.max_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+        )
+        return aiohttp.ClientSession(
+            connector=connector,
+            headers={'User-Agent': USER_AGENT},
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+
+    def _finish(self, url: str, download: Download) -> (str, str):
+        """Store a new, whole download in the cache."""
+        if download.html is not None and self.cache is not None and not download.truncated:
+            self.cache.put(url, download.html, download.text, download.etag, download.last_modified)
+        return download.text, download.status
+
+    async def _get(self, url: str, max_tokens: int = None) -> Download:
+        loop = asyncio.get_running_loop()
+        page = None
+        if self.cache is not None:
+            page = await loop.run_in_executor(None, self.cache.get, url)
+            if page is not None and page.is_fresh(self.cache.ttl):
+                self.cache.record("hit")
+                return Download(page.markdown, "Success", None, page.etag, page.last_modified)
+
+        try:
+            async with self._session.get(url, headers=page.validators() if page is not None else None) as response:
+                if response.status == 304 and page is not None:
+                    await loop.run_in_executor(None, self.cache.refresh, url)
+                    self.cache.record("revalidated")
+                    return Download(page.markdown, "Success", None, page.etag, page.last_modified)
+                if self.cache is not None:
+                    self.cache.record("miss")
+                if response.status // 100 != 2:
+                    print(f"Failed to fetch the webpage {url}. Status Code: {response.status}")
+                    return Download("", f"Failed. Status Code: {response.status}", None, "", "")
+
+                content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+                if content_type and content_type not in self.content_types:
+                    print(f"Skipping {url}. Content-Type: {content_type}")
+                    return Download("", f"Skipped. Content-Type: {content_type}", None, "", "")
+
+                html, text, truncated = await self._read(url, response, max_tokens)
+                return Download(text, "Success", html,
+                                response.headers.get("ETag", ""), response.headers.get("Last-Modified", ""), truncated)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            print(f"An error occurred: {err!r}")
+            return Download("", f"An error occurred: {err!r}", None, "", "")
+
+    async def _read(self, url: str, response: aiohttp.ClientResponse, max_tokens: int = None) -> (str, str, bool):
+        """
+        Read, decode and convert a response body as it arrives, within the byte and token limits. Returns the HTML,
+        the text, and whether a limit cut the body short.
+        """
+        loop = asyncio.get_running_loop()
+        converter = self.converter() if self.converter is not None else None
+        count = bool(max_tokens) and self.token_counter is not None
+        decoder = None
+        html_parts = []
+        text_parts = []
+        received = 0
+        tokens = 0
+        truncated = False
+
+        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+            if received + len(chunk) > self.max_bytes:
+                chunk = chunk[:self.max_bytes - received]
+                print(f"Truncated {url} at {self.max_bytes} bytes")
+                truncated = True
+            received += len(chunk)
+            if decoder is None:
+                decoder = codecs.getincrementaldecoder(self._charset(response, chunk))(errors="replace")
+
+            html, text, chunk_tokens = await loop.run_in_executor(
+                None, self._convert, decoder, converter, chunk, False, count)
+            html_parts.append(html)
+            text_parts.append(text)
+
+            tokens += chunk_tokens
+            if count and tokens >= max_tokens:
+                print(f"Stopped reading {url} after {tokens} tokens")
+                truncated = True
+                break
+            if received >= self.max_bytes:
+                break
+
+        if decoder is not None or converter is not None:
+            html, text, _ = await loop.run_in_executor(None, self._convert, decoder, converter, b"", True, False)
+            html_parts.append(html)
+            text_parts.append(text)
+        return "".join(html_parts), "".join(text_parts), truncated
+
+    def _convert(self, decoder, converter, chunk: bytes, final: bool, count: bool) -> (str, str, int):
+        """Decode and convert one chunk of a body, closing the converter on the `final` one, and count its tokens."""
+        html = decoder.decode(chunk, final=final) if decoder is not None else ""
+        text = html
+        if converter is not None:
+            converter.feed(html)
+            if final:
+                converter.close()
+            text = converter.read()
+        return html, text, self.token_counter(text) if count else 0
+
+    @staticmethod
+    def _charset(response: aiohttp.ClientResponse, head: bytes) -> str:
+        """Pick the body charset from the Content-Type header, then a <meta> tag, then UTF-8."""
+        match = META_CHARSET_PATTERN.search(head[:4096])
+        for charset in (response.charset, match.group(1).decode() if match else None):
+            if charset:
+                try:
+                    return codecs.lookup(charset).name
+                except LookupError:
+                    continue
+        return "utf-8"
@@ -0,0 +1,88 @@
+import os
+import sys
+import threading
+
+
+class ProgressWriter:
+    """
+    Write research output to the terminal and to a file as it arrives, instead of all at once at the end.
+
+    `source` writes a finished block of bullets for one source, such as a page that has just been extracted. A function
+    from `writer` writes pieces of streamed text, such as the next few tokens of the final answer, under a heading that
+    is written before the first piece. Everything goes to `out` and to `path`, flushed after every write so the file
+    can be followed while the run goes on. The file is started over on the first write, so a resumed run that writes to
+    the file of an earlier attempt replaces its output instead of adding to it. Text that may still be discarded, such
+    as an answer that a retry can replace, is written to `out` only with `writer(heading, save=False)`, and its final
+    version is added to the file with `save`. Writes from different threads do not interleave within a block.
+
+    Example Usage:
+    >>> progress = ProgressWriter("research_result.txt")
+    >>> progress.source("Dispersed Camping", "https://example.com", bullets)
+    >>> write_answer = progress.writer("Answer", save=False)
+    >>> for piece in pieces:
+    >>>     write_answer(piece)
+    >>> progress.save("Answer", answer)
+    >>> progress.close()
+    """
+
+    def __init__(self, path: str = None, out=sys.stdout):
+        self.path = path
+        self.out = out
+        self.sources = 0
+        self.headings = set()
+        self._lock = threading.Lock()
+        self._file = None
+
+    def source(self, title: str, url: str, text: str):
+        text = text.strip()
+        if not text:
+            return
+        header = f"### {title}\n{url}\n" if url else f"### {title}\n"
+        with self._lock:
+            self.sources += 1
+            self._emit(f"\n{header}\n{text}\n")
+
+    def section(self, heading: str):
+        with self._lock:
+            self._section(heading)
+
+    def writer(self, heading: str, save: bool = True):
+        """Return a function that writes streamed text under `heading`, to the file too unless `save` is False."""
+        def write(text: str):
+            with self._lock:
+                if heading not in self.headings:
+                    self._section(heading, save)
+                self._emit(text, save)
+        return write
+
+    def save(self, heading: str, text: str):
+        """Write a finished section to the file only, such as the final version of text streamed with save=False."""
+        with self._lock:
+            self._write_file(f"\n## {heading}\n\n{text}\n")
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _section(self, heading: str, save: bool = True):
+        self.headings.add(heading)
+        self._emit(f"\n## {heading}\n\n", save)
+
+    def _emit(self, text: str, save: bool = True):
+        self.out.write(text)
+        self.out.flush()
+        if save:
+            self._write_file(text)
+
+    def _write_file(self, text: str):
+        if self.path is None:
+            return
+        if self._file is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(self.path, "w")
+        self._file.write(text)
+        self._file.flush()
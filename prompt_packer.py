@@ -0,0 +1,60 @@
+from collections import namedtuple
+from token_chunker import TokenChunker
+
+
+# Tokens of a chat request outside the message text: role and separator tokens, and the reply primer.
+PROMPT_OVERHEAD_TOKENS = 16
+
+ModelWindow = namedtuple("ModelWindow", ["context_tokens", "output_reserve"])
+
+
+class PromptPacker:
+    """
+    Size the content of prompts to the context window of the model that will serve the call.
+
+    `windows` maps a model name to its `ModelWindow`: the context window in tokens, and the tokens kept free for the
+    completion. `budget` is what is left for content once the prompt template and the reserve are taken out. When the
+    completion restates the content, as the fold and merge prompts do, the content gets at most half of the room
+    after the template, leaving the other half for the answer. Models without an entry use `default`.
+
+    Example Usage:
+    >>> packer = PromptPacker({"gpt-3.5-turbo-16k-0613": ModelWindow(16385, 2048)}, default=ModelWindow(8191, 1024))
+    >>> max_tokens = packer.budget("gpt-3.5-turbo-16k-0613", count_message_tokens(prompt(question, "")))
+    >>> for segment in packer.split(markdown_text, max_tokens):
+    >>>     print(count_tokens(segment))
+    """
+
+    def __init__(self, windows: dict, default: ModelWindow = ModelWindow(4096, 1024), overlap: int = 0,
+                 boundary: str = "paragraph"):
+        self.windows = dict(windows)
+        self.default = default
+        self.overlap = overlap
+        self.boundary = boundary
+        self._chunkers = {}
+
+    def window(self, model_name: str) -> ModelWindow:
+        return self.windows.get(model_name, self.default)
+
+    def budget(self, model_name: str, template_tokens: int, rewrite: bool = False) -> int:
+        """Tokens of content that fit in a prompt for `model_name` around a template of `template_tokens` tokens."""
+        context_tokens, output_reserve = self.window(model_name)
+        room = context_tokens - template_tokens - PROMPT_OVERHEAD_TOKENS
+        if rewrite:
+            return max(0, min(room - output_reserve, room // 2))
+        return max(0, room - output_reserve)
+
+    def split(self, text: str, max_tokens: int) -> list[str]:
+        """Cut text into segments of at most `max_tokens` tokens, at paragraph boundaries where possible."""
+        return self._chunker(max_tokens, self.boundary).chunk(text)
+
+    def pack(self, items: list[str], max_tokens: int, separator: str = "\n") -> list[str]:
+        """Join whole items into batches of at most `max_tokens` tokens."""
+        return self._chunker(max_tokens, None).pack(items, separator)
+
+    def _chunker(self, max_tokens: int, boundary: str) -> TokenChunker:
+        max_tokens = max(1, int(max_tokens))
+        key = (max_tokens, boundary)
+        if key not in self._chunkers:
+            overlap = min(self.overlap, max_tokens // 4) if boundary is not None else 0
+            self._chunkers[key] = TokenChunker(max_tokens, overlap=overlap, boundary=boundary)
+        return self._chunkers[key]
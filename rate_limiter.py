@@ -0,0 +1,177 @@
+import random
+import threading
+import time
+
+
+class ModelLimiter:
+    """
+    Requests-per-minute and tokens-per-minute token buckets for one model.
+
+    Both buckets start full and refill continuously. Callers are served strictly in arrival order: each takes a ticket
+    and waits until it is at the head of the queue and both buckets hold enough for its request. A limit of 0 turns
+    that bucket off. Tokens spent beyond the estimate, such as completion tokens, can be charged afterwards with
+    `debit`, which may leave the token bucket in debt for later callers to wait out.
+    """
+
+    def __init__(self, requests_per_minute: int = 0, tokens_per_minute: int = 0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._condition = threading.Condition()
+        self._next_ticket = 0
+        self._serving = 0
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.acquired = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def acquire(self, tokens: int = 0) -> float:
+        """Block until a request of `tokens` prompt tokens may be sent, and return the seconds waited."""
+        if self.tokens_per_minute:
+            tokens = min(tokens, self.tokens_per_minute)
+        start = time.monotonic()
+        with self._condition:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            self.queue_depth += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+            while True:
+                if ticket == self._serving:
+                    self._refill()
+                    delay = self._delay(tokens)
+                    if delay <= 0:
+                        break
+                    self._condition.wait(delay)
+                else:
+                    self._condition.wait()
+            self._requests -= 1
+            self._tokens -= tokens
+            self._serving += 1
+            self.queue_depth -= 1
+            waited = time.monotonic() - start
+            self.acquired += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            self._condition.notify_all()
+        return waited
+
+    def debit(self, tokens: int):
+        """Charge tokens that were not part of the estimate given to `acquire`."""
+        with self._condition:
+            self._refill()
+            self._tokens -= tokens
+
+    def pause(self, seconds: float):
+        """Hold every caller for `seconds`, for example after the API answered with a rate limit error."""
+        with self._condition:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self._condition.notify_all()
+
+    def metrics(self) -> dict:
+        with self._condition:
+            return {
+                "requests": self.acquired,
+                "queue_depth": self.queue_depth,
+                "max_queue_depth": self.max_queue_depth,
+                "total_wait": self.total_wait,
+                "average_wait": self.total_wait / self.acquired if self.acquired else 0.0,
+                "max_wait": self.max_wait,
+            }
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        if self.requests_per_minute:
+            self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+    def _delay(self, tokens: int) -> float:
+        """Seconds until both buckets can cover the request, 0 when they can now."""
+        delay = self._blocked_until - time.monotonic()
+        if self.requests_per_minute and self._requests < 1:
+            delay = max(delay, (1 - self._requests) * 60 / self.requests_per_minute)
+        if self.tokens_per_minute and self._tokens < tokens:
+            delay = max(delay, (tokens - self._tokens) * 60 / self.tokens_per_minute)
+        return delay
+
+
+class RateLimiter:
+    """
+    Process-wide rate limits for API traffic, one `ModelLimiter` per model.
+
+    `limits` maps a model name to its `(requests_per_minute, tokens_per_minute)`; models without an entry use
+    `default`.
+
+    Example Usage:
+    >>> limiter = RateLimiter({"gpt-4-0613": (200, 40000)})
+    >>> limiter.acquire("gpt-4-0613", prompt_tokens)
+    >>> completion = openai.ChatCompletion.create(model="gpt-4-0613", messages=msgs)
+    >>> limiter.debit("gpt-4-0613", completion["usage"]["completion_tokens"])
+    """
+
+    def __init__(self, limits: dict = None, default: tuple = (0, 0)):
+        self.limits = dict(limits or {})
+        self.default = default
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def for_model(self, model_name: str) -> ModelLimiter:
+        with self._lock:
+            if model_name not in self._models:
+                self._models[model_name] = ModelLimiter(*self.limits.get(model_name, self.default))
+            return self._models[model_name]
+
+    def acquire(self, model_name: str, tokens: int = 0) -> float:
+        return self.for_model(model_name).acquire(tokens)
+
+    def debit(self, model_name: str, tokens: int):
+        self.for_model(model_name).debit(tokens)
+
+    def pause(self, model_name: str, seconds: float):
+        self.for_model(model_name).pause(seconds)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            models = dict(self._models)
+        return {name: limiter.metrics() for name, limiter in models.items()}
+
+    def report(self) -> str:
+        lines = []
+        for name, m in self.metrics().items():
+            lines.append(f"Rate limiter {name}: {m['requests']} requests, waited {m['total_wait']:.1f}s "
+                         f"(average {m['average_wait']:.2f}s, max {m['max_wait']:.2f}s), "
+                         f"max queue depth {m['max_queue_depth']}")
+        return "\n".join(lines)
+
+
+def backoff_delay(retry: int, base: float = 5, cap: float = 300, retry_after: float = None) -> float:
+    """
+    Seconds to wait before retry number `retry` (from 1).
+
+    A server supplied Retry-After wins. Otherwise the delay is drawn uniformly between half and all of the
+    exponential backoff `base * 2 ** (retry - 1)`, capped at `cap`, so callers that failed together retry apart.
+    """
+    if retry_after is not None and retry_after >= 0:
+        return retry_after
+    ceiling = min(cap, base * 2 ** (retry - 1))
+    return random.uniform(ceiling / 2, ceiling)
+
+
+def retry_after_seconds(headers) -> float:
+    """Read a Retry-After header given in seconds, or None."""
+    if not headers:
+        return None
+    for name in ("retry-after", "Retry-After"):
+        value = headers.get(name)
+        if value is not None:
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                return None
+    return None
@@ -0,0 +1,118 @@
+import re
+import threading
+import time
+
+
+WORD_PATTERN = re.compile(r"\w+")
+SHINGLE_SIZE = 3
+
+# USD per 1000 prompt and completion tokens.
+DEFAULT_PRICES = {
+    "gpt-3.5-turbo-16k-0613": (0.003, 0.004),
+    "gpt-3.5-turbo-0613": (0.0015, 0.002),
+    "gpt-4-0613": (0.03, 0.06),
+    "gpt-4-32k-0613": (0.06, 0.12),
+}
+
+
+def parse_price(value: str) -> tuple:
+    """Read a "prompt,completion" price pair in USD per 1000 tokens, such as "0.03,0.06"."""
+    prompt, completion = (float(part) for part in value.split(","))
+    return prompt, completion
+
+
+class ResearchBudget:
+    """
+    Caps on the tokens, estimated cost, wall time and LLM calls of one research run, and a check for diminishing
+    returns.
+
+    Every API call is charged with `record`. A limit of 0 is no limit. Research (scoring and extraction) should stop
+    once `stop_reason` returns a reason: when any limit is used up apart from its `reserve` share, which is kept for
+    consolidating what was found, or when the last `patience` sources added to `add_source` each brought less than
+    `min_novelty` of new content. Consolidation may spend the reserve; only `out_of_time` is a hard stop.
+
+    Example Usage:
+    >>> budget = ResearchBudget(max_cost=0.50, max_seconds=300)
+    >>> budget.record("gpt-4-0613", prompt_tokens, completion_tokens)
+    >>> if budget.stop_reason():
+    >>>     print(budget.report())
+    """
+
+    def __init__(self, max_tokens: int = 0, max_cost: float = 0.0, max_seconds: float = 0.0, max_calls: int = 0,
+                 prices: dict = None, reserve: float = 0.2, min_novelty: float = 0.0, patience: int = 3):
+        self.max_tokens = max_tokens
+        self.max_cost = max_cost
+        self.max_seconds = max_seconds
+        self.max_calls = max_calls
+        self.prices = dict(DEFAULT_PRICES, **(prices or {}))
+        self.reserve = reserve
+        self.min_novelty = min_novelty
+        self.patience = max(1, patience)
+        self.started = time.monotonic()
+        self.tokens = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+        self.calls = 0
+        self.sources = 0
+        self.stale_sources = 0
+        self.stopped = ""
+        self._shingles = set()
+        self._lock = threading.Lock()
+
+    @property
+    def limited(self) -> bool:
+        return bool(self.max_tokens or self.max_cost or self.max_seconds or self.max_calls or self.min_novelty)
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def record(self, model_name: str, prompt_tokens: int, completion_tokens: int):
+        """Charge one API call."""
+        prompt_price, completion_price = self.prices.get(model_name, (0.0, 0.0))
+        with self._lock:
+            self.calls += 1
+            self.tokens += prompt_tokens + completion_tokens
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.cost += (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+    def add_source(self, text: str) -> float:
+        """Add the text found in one source, and return the share of its word shingles that were new."""
+        words = WORD_PATTERN.findall(text.lower())
+        shingles = {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(max(1, len(words) - SHINGLE_SIZE + 1))}
+        with self._lock:
+            new = shingles - self._shingles
+            self._shingles |= new
+            novelty = len(new) / len(shingles) if shingles and words else 0.0
+            self.sources += 1
+            self.stale_sources = self.stale_sources + 1 if novelty < self.min_novelty else 0
+        return novelty
+
+    def stop_reason(self) -> str:
+        """Return why research should stop now, or an empty string while it may go on. The first reason sticks."""
+        share = 1 - self.reserve
+        with self._lock:
+            if not self.stopped:
+                if self.max_tokens and self.tokens >= self.max_tokens * share:
+                    self.stopped = f"the run used {self.tokens} of {self.max_tokens} tokens"
+                elif self.max_cost and self.cost >= self.max_cost * share:
+                    self.stopped = f"the run spent ${self.cost:.2f} of ${self.max_cost:.2f}"
+                elif self.max_calls and self.calls >= self.max_calls * share:
+                    self.stopped = f"the run made {self.calls} of {self.max_calls} LLM calls"
+                elif self.max_seconds and self.elapsed() >= self.max_seconds * share:
+                    self.stopped = f"the run took {self.elapsed():.0f}s of {self.max_seconds:.0f}s"
+                elif self.min_novelty and self.stale_sources >= self.patience:
+                    self.stopped = f"the last {self.stale_sources} sources added little new information"
+            return self.stopped
+
+    def out_of_time(self, delay: float = 0.0) -> bool:
+        """True when waiting another `delay` seconds would run past the wall time limit."""
+        return bool(self.max_seconds) and self.elapsed() + delay >= self.max_seconds
+
+    def report(self) -> str:
+        line = (f"Research budget: {self.calls} LLM calls, {self.tokens} tokens, ${self.cost:.2f} estimated, "
+                f"{self.elapsed():.0f}s, {self.sources} sources")
+        if self.stopped:
+            line += f"; research stopped early because {self.stopped}"
+        return line
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+def new_run_id(question: str) -> str:
+    """A run id that sorts by start time and names the question it answers."""
+    digest = hashlib.sha256(question.encode()).hexdigest()[:8]
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{digest}"
+
+
+class RunCheckpoint:
+    """
+    Durable checkpoints of the work done by one research run, so an interrupted run can be resumed.
+
+    A run lives in `runs_dir/run_id`: `run.json` records the question and the options the run was started with, and
+    `checkpoints.jsonl` gets one line per finished piece of work, such as a generated query, a score or an extracted
+    page. Work is keyed by its stage and by what it depends on, usually the question and the query or URL, so a resumed
+    run finds the work it already did and makes only the calls that are left. Lines are appended and synced to disk as
+    they are written; a line cut short by a crash is ignored when the run is loaded.
+
+    Example Usage:
+    >>> checkpoint = RunCheckpoint(".cache/runs", new_run_id(question))
+    >>> checkpoint.start(question, {"web": 10})
+    >>> query = checkpoint.get("query", (question, "web"))
+    >>> if query is None:
+    >>>     query = generate_query(question)
+    >>>     checkpoint.put("query", (question, "web"), query)
+    """
+
+    def __init__(self, runs_dir: str, run_id: str):
+        self.run_id = run_id
+        self.path = os.path.join(runs_dir, run_id)
+        self.resumed = 0
+        self.saved = 0
+        self._values = {}
+        self._lock = threading.Lock()
+        self._file = None
+        self._load()
+
+    def exists(self) -> bool:
+        return os.path.exists(os.path.join(self.path, "run.json"))
+
+    def start(self, question: str, options: dict):
+        """Record the question and options of a new run."""
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, "run.json"), "w") as file:
+            json.dump({"run_id": self.run_id, "question": question, "options": options,
+                       "started_at": time.time()}, file, indent=2)
+
+    def manifest(self) -> dict:
+        """The question and options the run was started with."""
+        with open(os.path.join(self.path, "run.json")) as file:
+            return json.load(file)
+
+    def get(self, stage: str, key: tuple):
+        """Return the checkpointed value of a piece of work, or None when it has not been done."""
+        with self._lock:
+            data = self._values.get(self._key(stage, key))
+            if data is None:
+                return None
+            self.resumed += 1
+        return json.loads(data)
+
+    def put(self, stage: str, key: tuple, value):
+        """Checkpoint a finished piece of work. The value must be JSON serializable."""
+        data = json.dumps(value, ensure_ascii=False)
+        line = json.dumps({"stage": stage, "key": self._key(stage, key), "value": value}, ensure_ascii=False)
+        with self._lock:
+            self._values[self._key(stage, key)] = data
+            self.saved += 1
+            if self._file is None:
+                os.makedirs(self.path, exist_ok=True)
+                self._file = open(os.path.join(self.path, "checkpoints.jsonl"), "a")
+            self._file.write(line + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def report(self) -> str:
+        return f"Run {self.run_id}: {self.resumed} steps resumed, {self.saved} checkpointed, in {self.path}"
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    @staticmethod
+    def _key(stage: str, key: tuple) -> str:
+        return hashlib.sha256(json.dumps([stage, list(key)], ensure_ascii=False).encode()).hexdigest()
+
+    def _load(self):
+        path = os.path.join(self.path, "checkpoints.jsonl")
+        if not os.path.exists(path):
+            return
+        with open(path) as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                self._values[record["key"]] = json.dumps(record["value"], ensure_ascii=False)
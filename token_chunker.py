@@ -0,0 +1,134 @@
+import re
+from functools import lru_cache
+import tiktoken
+
+
+ENCODING_MODEL_NAME = "gpt-4"
+
+PARAGRAPH_PATTERN = re.compile(r"\S.*?(?:\n\s*\n|\Z)", re.DOTALL)
+SENTENCE_PATTERN = re.compile(r"\S.*?(?:[.!?](?=\s)\s*|\n\s*\n|\Z)", re.DOTALL)
+BOUNDARY_PATTERNS = {
+    "paragraph": PARAGRAPH_PATTERN,
+    "sentence": SENTENCE_PATTERN,
+}
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model_name: str = ENCODING_MODEL_NAME):
+    """Returns the tiktoken encoder for a model, building it only once per process."""
+    return tiktoken.encoding_for_model(model_name)
+
+
+def encode(string: str, model_name: str = ENCODING_MODEL_NAME) -> list[int]:
+    """Encodes a string to token ids, treating special token text in page content as plain text."""
+    return get_encoding(model_name).encode(string, disallowed_special=())
+
+
+def count_tokens(string: str, model_name: str = ENCODING_MODEL_NAME) -> int:
+    """Returns the number of tokens in a text string."""
+    return len(encode(string, model_name))
+
+
+class TokenChunker:
+    """
+    Split text into segments of at most `max_tokens` tokens.
+
+    The text is encoded once and segments are cut from the token ids, so the cost is linear in the length of the
+    text. With a `boundary` of "sentence" or "paragraph" the text is first split into units at those boundaries and
+    units are packed into segments whole; a unit that is longer than `max_tokens` on its own is cut on token
+    boundaries. `overlap` is the number of tokens from the end of a segment that are repeated at the start of the
+    next one.
+
+    Example Usage:
+    >>> chunker = TokenChunker(4000, overlap=200, boundary="paragraph")
+    >>> for segment in chunker.chunk(markdown_text):
+    >>>     print(count_tokens(segment))
+    """
+
+    def __init__(self, max_tokens: int, overlap: int = 0, boundary: str = None,
+                 model_name: str = ENCODING_MODEL_NAME):
+        if max_tokens <= 0:
+            raise ValueError("max_tokens must be greater than zero.")
+        if overlap < 0 or overlap >= max_tokens:
+            raise ValueError("overlap must be zero or more, and less than max_tokens.")
+        if boundary is not None and boundary not in BOUNDARY_PATTERNS:
+            raise ValueError(f"Unknown boundary '{boundary}'. Expected one of {sorted(BOUNDARY_PATTERNS)}.")
+        self.max_tokens = int(max_tokens)
+        self.overlap = int(overlap)
+        self.boundary = boundary
+        self.model_name = model_name
+
+    def chunk(self, text: str) -> list[str]:
+        """Return the segments of `text`, in order."""
+        if not text.strip():
+            return []
+        if self.boundary is None:
+            return [self._decode(ids) for ids in self._slice(encode(text, self.model_name))]
+        return [self._decode(ids) for ids in self._pack_units(self._units(text))]
+
+    def pack(self, items: list[str], separator: str = "\n") -> list[str]:
+        """
+        Join whole items into batches of at most `max_tokens` tokens.
+
+        Each item is counted once. An item that does not fit in a batch on its own is put in a batch by itself rather
+        than split, so a batch can only go over the limit when a single item does.
+        """
+        separator_tokens = count_tokens(separator, self.model_name) if items else 0
+        batches = []
+        batch = []
+        batch_tokens = 0
+        for item in items:
+            item_tokens = count_tokens(item, self.model_name)
+            added_tokens = item_tokens + (separator_tokens if batch else 0)
+            if batch and batch_tokens + added_tokens > self.max_tokens:
+                batches.append(separator.join(batch))
+                batch = []
+                batch_tokens = 0
+                added_tokens = item_tokens
+            batch.append(item)
+            batch_tokens += added_tokens
+        if batch:
+            batches.append(separator.join(batch))
+        return batches
+
+    def _decode(self, ids: list[int]) -> str:
+        return get_encoding(self.model_name).decode(ids)
+
+    def _slice(self, ids: list[int]) -> list[list[int]]:
+        step = self.max_tokens - self.overlap
+        slices = []
+        for start in range(0, len(ids), step):
+            slices.append(ids[start:start + self.max_tokens])
+            if start + self.max_tokens >= len(ids):
+                break
+        return slices
+
+    def _units(self, text: str) -> list[list[int]]:
+        """Encode each boundary unit of the text once; units larger than a segment are pre-cut."""
+        units = []
+        for match in BOUNDARY_PATTERNS[self.boundary].finditer(text):
+            ids = encode(match.group(0), self.model_name)
+            if len(ids) > self.max_tokens:
+                units.extend(self._slice(ids))
+            elif ids:
+                units.append(ids)
+        return units
+
+    def _pack_units(self, units: list[list[int]]) -> list[list[int]]:
+        segments = []
+        segment = []
+        carried = 0
+        for ids in units:
+            if len(segment) > carried and len(segment) + len(ids) > self.max_tokens:
+                segments.append(segment)
+                segment = self._tail(segment, self.max_tokens - len(ids))
+                carried = len(segment)
+            segment.extend(ids)
+        if len(segment) > carried:
+            segments.append(segment)
+        return segments
+
+    def _tail(self, ids: list[int], room: int) -> list[int]:
+        """Return the overlap to carry into the next segment, limited to the room left beside the next unit."""
+        size = min(self.overlap, max(room, 0))
+        return ids[-size:] if size > 0 else []
@@ -0,0 +1,83 @@
+import json
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+
+
+class ToolDispatcher:
+    """
+    Run the functions a chat model calls on a pool of worker threads, with a timeout and memoized results.
+
+    Tools are registered by name. A call is keyed by the tool and its arguments, and its result is reused for `ttl`
+    seconds; a call that fails is not kept. A call made while the same call is still running waits for that one
+    instead of starting another, which is what lets `start_partial` begin a call while its arguments are still
+    streaming: once the streamed arguments parse as a JSON object the call starts, and the `call` made when the stream
+    ends finds it already running or done.
+
+    Example Usage:
+    >>> tools = ToolDispatcher(max_workers=4, timeout=30, ttl=600)
+    >>> tools.register("web_search", lambda query: web_search(query, 1000))
+    >>> for piece in streamed_arguments:
+    >>>     arguments += piece
+    >>>     tools.start_partial("web_search", arguments)
+    >>> output = tools.call("web_search", json.loads(arguments))
+    """
+
+    def __init__(self, max_workers: int = 4, timeout: float = 30, ttl: float = 600):
+        self.timeout = timeout
+        self.ttl = ttl
+        self.tools = {}
+        self.hits = 0
+        self.misses = 0
+        self._calls = {}  # (name, arguments JSON) -> (started_at, future)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+
+    def register(self, name: str, fn):
+        """Register `fn` to be called with the keyword arguments the model passes to the tool `name`."""
+        self.tools[name] = fn
+
+    def start(self, name: str, arguments: dict) -> Future:
+        """Start a call, or return the future of the same call if it is running or finished within `ttl`."""
+        if name not in self.tools:
+            raise ValueError(f"invalid function name {name}")
+        key = (name, json.dumps(arguments, sort_keys=True))
+        now = time.monotonic()
+        with self._lock:
+            for expired in [k for k, (started_at, _) in self._calls.items() if now - started_at >= self.ttl]:
+                del self._calls[expired]
+            if key in self._calls:
+                started_at, future = self._calls[key]
+                if not (future.done() and future.exception() is not None):
+                    self.hits += 1
+                    return future
+            self.misses += 1
+            future = self._executor.submit(self.tools[name], **arguments)
+            self._calls[key] = (now, future)
+        return future
+
+    def start_partial(self, name: str, arguments: str) -> Future:
+        """Start a call as soon as the streamed `arguments` form a JSON object; until then return None."""
+        if name not in self.tools or not arguments.rstrip().endswith("}"):
+            return None
+        try:
+            params = json.loads(arguments)
+        except ValueError:
+            return None
+        if not isinstance(params, dict):
+            return None
+        return self.start(name, params)
+
+    def call(self, name: str, arguments: dict) -> str:
+        """Run a call, or reuse a running or memoized one, and wait up to `timeout` seconds for its output."""
+        future = self.start(name, arguments)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise TimeoutError(f"{name} did not finish in {self.timeout}s")
+
+    def report(self) -> str:
+        return f"Tool calls: {self.misses} run, {self.hits} reused"
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
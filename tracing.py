@@ -0,0 +1,156 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+
+class Span:
+    """A timed section of work with attributes such as the model, token counts and retries."""
+    __slots__ = ("tracer", "name", "attributes", "parent", "start", "end", "thread_id")
+
+    def __init__(self, tracer, name: str, attributes: dict):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.parent = None
+        self.start = 0.0
+        self.end = 0.0
+        self.thread_id = threading.get_ident()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add(self, name: str, value: float = 1):
+        """Add to a numeric attribute, such as a retry count."""
+        self.attributes[name] = self.attributes.get(name, 0) + value
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+    def __enter__(self):
+        stack = self.tracer.stack()
+        self.parent = stack[-1].name if stack else None
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end = time.perf_counter()
+        if exc_type is not None:
+            self.attributes["error"] = repr(exc_value)
+        self.tracer.stack().pop()
+        self.tracer.record(self)
+        return False
+
+
+class NullSpan:
+    """The span handed out while tracing is off; every method does nothing."""
+    __slots__ = ()
+
+    def set(self, **attributes):
+        pass
+
+    def add(self, name: str, value: float = 1):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Tracer:
+    """
+    Collect spans for each stage of a run and export them.
+
+    While `enabled` is False, `span` returns a shared no-op span, so instrumented code pays only for the call. Spans
+    nest per thread. Finished spans can be written as a JSON list with `export_json`, in the Chrome trace event format
+    (load it in chrome://tracing or Perfetto) with `export_chrome`, or summarized per stage with `summary`.
+
+    Example Usage:
+    >>> tracer = Tracer(enabled=True)
+    >>> with tracer.span("llm", model=model_name) as span:
+    >>>     completion = call_api(msgs)
+    >>>     span.set(prompt_tokens=completion["usage"]["prompt_tokens"])
+    >>> print(tracer.summary())
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.spans = []
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def span(self, name: str, **attributes):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, attributes)
+
+    def stack(self) -> list:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def record(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def export_json(self, path: str):
+        with self._lock:
+            spans = list(self.spans)
+        records = [{
+            "name": s.name,
+            "parent": s.parent,
+            "thread": s.thread_id,
+            "start": round(s.start - self._origin, 6),
+            "duration": round(s.duration, 6),
+            "attributes": s.attributes,
+        } for s in spans]
+        with open(path, "w") as file:
+            json.dump(records, file, indent=2, default=str)
+
+    def export_chrome(self, path: str):
+        with self._lock:
+            spans = list(self.spans)
+        events = [{
+            "name": s.name,
+            "cat": s.attributes.get("model", "stage"),
+            "ph": "X",
+            "ts": round((s.start - self._origin) * 1e6),
+            "dur": round(s.duration * 1e6),
+            "pid": os.getpid(),
+            "tid": s.thread_id,
+            "args": s.attributes,
+        } for s in spans]
+        with open(path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file, default=str)
+
+    def summary(self) -> str:
+        """A table of calls, time, tokens and retries for each span name, and each model for LLM calls."""
+        with self._lock:
+            spans = list(self.spans)
+        rows = defaultdict(lambda: [0, 0.0, 0.0, 0, 0, 0])
+        for s in spans:
+            key = f"{s.name} {s.attributes['model']}" if "model" in s.attributes else s.name
+            row = rows[key]
+            row[0] += 1
+            row[1] += s.duration
+            row[2] = max(row[2], s.duration)
+            row[3] += s.attributes.get("prompt_tokens", 0)
+            row[4] += s.attributes.get("completion_tokens", 0)
+            row[5] += s.attributes.get("retries", 0)
+
+        lines = [f"{'stage':<40} {'count':>6} {'total s':>9} {'max s':>8} {'prompt tok':>11} {'compl tok':>10} "
+                 f"{'retries':>8}"]
+        for key, (count, total, longest, prompt, completion, retries) in sorted(
+                rows.items(), key=lambda item: -item[1][1]):
+            lines.append(f"{key[:40]:<40} {count:>6} {total:9.2f} {longest:8.2f} {prompt:>11} {completion:>10} "
+                         f"{retries:>8}")
+        return "\n".join(lines)
@@ -1,65 +1,140 @@
+import contextvars
+import copy
+import heapq
 import json
+import math
 import os
 import time
 import re
 import threading
 import argparse
 import json
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
 from datetime import datetime
 from time import sleep
 import pytz
 import openai
-import tiktoken
 from duckduckgo_search import DDGS
-import wikipedia
-import requests
-from bs4 import BeautifulSoup
+from bullets import BulletList
+from dedup import dedupe_results, dedupe_texts
+from html_markdown import MarkdownConverter
+from lexical_rank import rank_results
+from llm_cache import ResponseCache, cache_key
+from page_cache import PageCache
+from rate_limiter import RateLimiter, backoff_delay, retry_after_seconds
+from research_budget import ResearchBudget, parse_price
+from run_checkpoint import RunCheckpoint, new_run_id
+from page_fetcher import PageFetcher
+from progress import ProgressWriter
+from prompt_packer import ModelWindow, PromptPacker
+from token_chunker import count_tokens
+from tracing import Tracer
+from wiki_client import WikipediaClient
+from work_queue import WorkQueue, task_cancelled
 
 
 FAST_MODEL_NAME = os.getenv("FAST_MODEL_NAME", "gpt-3.5-turbo-16k-0613")
 FAST_MODEL_MAX_TOKENS = int(os.getenv("FAST_MODEL_MAX_TOKENS", "16385"))
 SMART_MODEL_NAME = os.getenv("SMART_MODEL_NAME", "gpt-4-0613")
 SMART_MODEL_MAX_TOKENS = int(os.getenv("SMART_MODEL_MAX_TOKENS", "8191"))
+CACHE_DIR = os.getenv("CACHE_DIR", ".cache")
+RUNS_DIR = os.getenv("RUNS_DIR", os.path.join(CACHE_DIR, "runs"))
+FAST_MODEL_OUTPUT_RESERVE = int(os.getenv("FAST_MODEL_OUTPUT_RESERVE", "2048"))
+SMART_MODEL_OUTPUT_RESERVE = int(os.getenv("SMART_MODEL_OUTPUT_RESERVE", "1024"))
+SEGMENT_OVERLAP_TOKENS = int(os.getenv("SEGMENT_OVERLAP_TOKENS", "0"))
+PAGE_MAX_TOKENS = int(os.getenv("PAGE_MAX_TOKENS", str(SMART_MODEL_MAX_TOKENS * 4)))
+MIN_CONTENT_TOKENS = 256  # below this, a prompt has no useful room left for more content
+# Extra Wikipedia titles searched beyond the results wanted, to make up for missing and disambiguation pages.
+WIKI_SEARCH_HEADROOM = int(os.getenv("WIKI_SEARCH_HEADROOM", "10"))
+
+# Segments and result batches are sized to the context window of the model that serves the call.
+prompt_packer = PromptPacker({
+    FAST_MODEL_NAME: ModelWindow(FAST_MODEL_MAX_TOKENS, FAST_MODEL_OUTPUT_RESERVE),
+    SMART_MODEL_NAME: ModelWindow(SMART_MODEL_MAX_TOKENS, SMART_MODEL_OUTPUT_RESERVE),
+}, default=ModelWindow(SMART_MODEL_MAX_TOKENS, SMART_MODEL_OUTPUT_RESERVE), overlap=SEGMENT_OVERLAP_TOKENS)
+
+EXTRACT_MODES = ("fold", "map-reduce", "delta")
+NO_INFORMATION = "NO RELEVANT INFORMATION"
+
+
+@dataclass
+class ResearchOptions:
+    """Settings for a research run, shared by every stage of the pipeline."""
+    extract_mode: str = os.getenv("EXTRACT_MODE", "fold")
+    extract_concurrency: int = int(os.getenv("EXTRACT_CONCURRENCY", "4"))
+    merge_concurrency: int = int(os.getenv("MERGE_CONCURRENCY", "4"))
+    score_batch_size: int = int(os.getenv("SCORE_BATCH_SIZE", "10"))
+    pool_size: int = int(os.getenv("POOL_SIZE", "4"))
+    task_timeout: float = float(os.getenv("TASK_TIMEOUT", "900"))
+    rank_top_k: int = int(os.getenv("RANK_TOP_K", "50"))
+    rank_min_score: float = float(os.getenv("RANK_MIN_SCORE", "0"))
+
+
+page_cache = PageCache(
+    os.path.join(CACHE_DIR, "pages.sqlite"),
+    ttl=float(os.getenv("PAGE_CACHE_TTL", "86400")),
+    max_bytes=int(os.getenv("PAGE_CACHE_MAX_BYTES", str(256 * 1024 * 1024))),
+)
+llm_cache = ResponseCache(
+    os.path.join(CACHE_DIR, "llm.sqlite"),
+    ttl=float(os.getenv("LLM_CACHE_TTL", str(7 * 86400))),
+    max_bytes=int(os.getenv("LLM_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+)
+# Caps the LLM requests in flight across every stage and both research branches, whatever their worker pools allow.
+llm_slots = threading.BoundedSemaphore(int(os.getenv("LLM_CONCURRENCY", "8")))
+rate_limiter = RateLimiter({
+    FAST_MODEL_NAME: (int(os.getenv("FAST_MODEL_RPM", "3500")), int(os.getenv("FAST_MODEL_TPM", "180000"))),
+    SMART_MODEL_NAME: (int(os.getenv("SMART_MODEL_RPM", "200")), int(os.getenv("SMART_MODEL_TPM", "40000"))),
+})
+page_fetcher = PageFetcher(
+    max_connections=int(os.getenv("FETCH_MAX_CONNECTIONS", "32")),
+    max_per_host=int(os.getenv("FETCH_MAX_PER_HOST", "4")),
+    converter=MarkdownConverter,
+    cache=page_cache,
+    max_bytes=int(os.getenv("PAGE_MAX_BYTES", str(4 * 1024 * 1024))),
+    token_counter=count_tokens,
+)
+search_slots = threading.BoundedSemaphore(int(os.getenv("SEARCH_CONCURRENCY", "4")))
+search_cache = {}  # (source, query, max_results) -> future of the search results, shared by every question of the run
+search_cache_lock = threading.Lock()
+wiki_client = WikipediaClient(
+    os.path.join(CACHE_DIR, "wikipedia.sqlite"),
+    ttl=float(os.getenv("WIKI_CACHE_TTL", str(7 * 86400))),
+    max_workers=int(os.getenv("WIKI_MAX_CONNECTIONS", "4")),
+    batch_size=int(os.getenv("WIKI_BATCH_SIZE", "20")),
+)
+tracer = Tracer(enabled=bool(os.getenv("TRACE", "")))
+progress = None  # a ProgressWriter that extracted sources are written to as they finish, when streaming
+# The ResearchBudget that API calls are charged to, per question: a batch runs several questions at once, each with its
+# own budget. Work handed to other threads takes the budget along with `in_context`.
+research_budget = contextvars.ContextVar("research_budget", default=None)
+run_checkpoint = None  # a RunCheckpoint that finished stages are saved to, so the run can be resumed
+
+
+def in_context(fn):
+    """Wrap `fn` to run in a copy of the caller's context, so work on other threads sees the caller's research budget."""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(fn, *args, **kwargs)
+
+
+def checkpointed(stage: str, key: tuple, compute, on_text=None):
+    """
+    Return the result of a stage that an earlier attempt of this run already finished, or compute and checkpoint it.
 
-
-def html_to_markdown(html):
-    soup = BeautifulSoup(html, 'html.parser')
-    markdown_text = ""
-
-    for tag in soup.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'a', 'ul', 'ol', 'li', 'p', 'br']):
-        if tag.name == 'h1':
-            markdown_text += '# {}\n'.format(tag.text.replace('\n', ' ').strip())
-        elif tag.name == 'h2':
-            markdown_text += '## {}\n'.format(tag.text.replace('\n', ' ').strip())
-        elif tag.name == 'h3':
-            markdown_text += '### {}\n'.format(tag.text.replace('\n', ' ').strip())
-        elif tag.name == 'h4':
-            markdown_text += '#### {}\n'.format(tag.text.replace('\n', ' ').strip())
-        elif tag.name == 'h5':
-            markdown_text += '##### {}\n'.format(tag.text.replace('\n', ' ').strip())
-        elif tag.name == 'h6':
-            markdown_text += '###### {}\n'.format(tag.text.replace('\n', ' ').strip())
-        elif tag.name == 'a':
-            markdown_text += '[{}]({})\n'.format(tag.text.replace('\n', ' ').strip(), tag.get('href', '').replace('\n', ' ').strip())
-        elif tag.name == 'ul':
-            for li in tag.find_all('li'):
-                markdown_text += '* {}\n'.format(li.text.replace('\n', ' ').strip())
-        elif tag.name == 'ol':
-            counter = 1
-            for li in tag.find_all('li'):
-                markdown_text += '{}. {}\n'.format(counter, li.text.replace('\n', ' ').strip())
-                counter += 1
-        elif tag.name == 'p':
-            markdown_text += '{}\n'.format(tag.text.replace('\n', ' ').strip())
-        elif tag.name == 'br':
-            markdown_text += '\n'
-        else:
-            markdown_text += tag.text.replace('\n', ' ').strip()
-
-        markdown_text = markdown_text.strip() + '\n\n'
-
-    markdown_text = re.sub(r' +', ' ', markdown_text)
-    return markdown_text
+    A resumed result is passed to `on_text` whole, as a streamed one would have been in pieces.
+    """
+    if run_checkpoint is None:
+        return compute()
+    value = run_checkpoint.get(stage, key)
+    if value is not None:
+        if on_text is not None:
+            on_text(value)
+        return value
+    value = compute()
+    run_checkpoint.put(stage, key, value)
+    return value
 
 
 def save_to_file(filename, content):
@@ -68,25 +143,12 @@ def save_to_file(filename, content):
         file.write(content)
 
 
-def count_tokens(string: str) -> int:
-    """Returns the number of tokens in a text string."""
-    encoding = tiktoken.encoding_for_model("gpt-4")
-    return len(encoding.encode(string))
-
-
-def extract_information_from_page(question: str, url: str, response: str, page_markdown: str) -> str:
-    """Extract relevant information from a webpage and combine it with an existing response."""
-    max_retry = 2
-    retry = 0
-
-    original_response_length = count_tokens(response)
-    model_name = FAST_MODEL_NAME
-
-    while retry < max_retry:
-        msgs = [
-            {
-                "role": "system",
-                "content": f"""Your task is to extract relevant information as bullet points from this web page for the question: '{question}'.
+def fold_prompt(question: str, response: str, page_markdown: str) -> list[dict]:
+    """Build the prompt that folds a page segment into the response so far."""
+    return [
+        {
+            "role": "system",
+            "content": f"""Your task is to extract relevant information as bullet points from this web page for the question: '{question}'.
  
 Instructions:
 1. Combine the information from the 'Current Response' and the 'New Page Segment'.
@@ -103,72 +165,206 @@ New Page Segment:
 {page_markdown}
 
 Please proceed with the task."""
-            }
-        ]
+        }
+    ]
 
-        new_response = interact_with_openai_api(msgs, stream=False, model_name=model_name)[
-            "choices"][0]["message"]["content"]
 
-        if count_tokens(new_response) >= original_response_length * 0.85:
-            return new_response
+def extract_information_from_page(question: str, url: str, response: str, page_markdown: str,
+                                  model_name: str = FAST_MODEL_NAME) -> str:
+    """
+    Extract relevant information from a webpage and combine it with an existing response.
 
-        print(
-            f"Retry {retry+1}: New response is shorter than original. Retrying for {url}")
-        retry += 1
-        if retry > 1:
-            model_name = SMART_MODEL_NAME
+    When the segment does not fit beside the response in the window of the model serving the call, as can happen once
+    a retry escalates to the smart model, it is re-packed into pieces that do and each piece is folded in turn.
+    """
+    max_retry = 3
+    retry = 0
+
+    original_response_length = count_tokens(response)
+    segment_tokens = count_tokens(page_markdown)
+    template_tokens = count_message_tokens(fold_prompt(question, "", ""))
+
+    with tracer.span("extract_segment", url=url) as span:
+        while retry < max_retry:
+            if task_cancelled():
+                span.set(cancelled=True)
+                return response
+            span.set(retries=retry, escalated=model_name == SMART_MODEL_NAME)
+            # The response is in the prompt and is written out again in the answer, so it takes its room twice.
+            room = prompt_packer.budget(model_name, template_tokens) - 2 * original_response_length
+            if segment_tokens > room:
+                return fold_pieces(question, url, response, page_markdown, model_name, room)
+
+            msgs = fold_prompt(question, response, page_markdown)
+            new_response = interact_with_openai_api(msgs, stream=False, model_name=model_name)[
+                "choices"][0]["message"]["content"]
+
+            if count_tokens(new_response) >= original_response_length * 0.85:
+                return new_response
 
-    print(
-        f"Max retries reached. Returning original response. Failed segment for {url}")
+            print(
+                f"Retry {retry+1}: New response is shorter than original. Retrying for {url}")
+            forget_response(msgs, model_name)
+            retry += 1
+            if retry > 1:
+                model_name = SMART_MODEL_NAME
+
+        span.set(retries=retry, failed=True)
+        print(
+            f"Max retries reached. Returning original response. Failed segment for {url}")
+        return response
+
+
+def fold_pieces(question: str, url: str, response: str, page_markdown: str, model_name: str, room: int) -> str:
+    """Fold a segment that is too large for `model_name` into the response in pieces of at most `room` tokens."""
+    if room < MIN_CONTENT_TOKENS:
+        print(f"The response for {url} leaves no room in the {model_name} window for more of the page, "
+              f"skipping a segment")
+        return response
+    pieces = prompt_packer.split(page_markdown, room)
+    print(f"Re-packed a segment of {url} into {len(pieces)} pieces for {model_name}")
+    for piece in pieces:
+        response = extract_information_from_page(question, url, response, piece, model_name)
     return response
 
 
-def extract_from_url(url: str, question: str) -> str:
-    """Scrape content from a URL and extract relevant information."""
+def segment_prompt(question: str, page_markdown: str) -> list[dict]:
+    """Build the prompt that extracts from a single page segment."""
+    return [
+        {
+            "role": "system",
+            "content": f"""Your task is to extract relevant information as bullet points from this web page segment for the question: '{question}'.
+
+Instructions:
+1. Extract every detail from the 'Page Segment' that is relevant to the question.
+2. Do not omit any details.
+3. Include quotes and relevant links.
+4. If the 'Page Segment' does not offer any relevant information, respond with exactly: {NO_INFORMATION}
+5. Please begin your response with the extracted information without referencing the instructions.
+
+Page Segment:
+{page_markdown}
+
+Please proceed with the task."""
+        }
+    ]
+
+
+def extract_information_from_segment(question: str, url: str, page_markdown: str) -> str:
+    """Extract relevant information from a single page segment, without any earlier response."""
+    budget = research_budget.get()
+    if task_cancelled() or (budget is not None and budget.stop_reason()):
+        return ""
+    msgs = segment_prompt(question, page_markdown)
+    with tracer.span("extract_segment", url=url):
+        response = interact_with_openai_api(msgs, stream=False)["choices"][0]["message"]["content"]
+    if NO_INFORMATION in response:
+        return ""
+    return response.strip()
+
+
+def map_reduce_extract(question: str, url: str, segments: list[str], max_workers: int) -> str:
+    """Extract from every segment concurrently, then merge the per-segment bullets into one response."""
+    print(f"Processing {len(segments)} page segments for {url}")
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(segments)))) as executor:
+        extracted = list(executor.map(
+            in_context(lambda segment: extract_information_from_segment(question, url, segment)), segments))
+
+    extracted = dedupe_texts([e for e in extracted if e], "extracted segments")
+    if task_cancelled():
+        return ""
+    if len(extracted) <= 1:
+        return "".join(extracted)
+
+    return tree_consolidate(question, pack_for_merge(question, extracted, separator="\n\n"), max_workers)
+
+
+def delta_extract(question: str, url: str, segments: list[str], max_workers: int) -> str:
+    """
+    Extract from every segment concurrently, and merge the bullets locally, each tagged with the URL.
+
+    No prompt carries the answer so far and no completion restates it: each call returns only the bullets of its own
+    segment, and repeats are dropped as they are merged.
+    """
+    print(f"Processing {len(segments)} page segments for {url}")
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(segments)))) as executor:
+        extracted = list(executor.map(
+            in_context(lambda segment: extract_information_from_segment(question, url, segment)), segments))
+
+    answer = BulletList()
+    for text in extracted:
+        answer.add_text(text, url)
+    return answer.render()
+
+
+def extract_from_url(url: str, question: str, options: ResearchOptions = None) -> str:
+    """
+    Scrape content from a URL and extract relevant information.
+
+    Extractions are checkpointed unless they came back empty or were cut short by the research budget, a timeout or
+    a cancelled queue, so a resumed run tries those pages again. A timed out or cancelled extraction stops before its
+    next segment, so it makes no more LLM calls whose results would be thrown away.
+    """
+    options = options or ResearchOptions()
+    budget = research_budget.get()
+    if run_checkpoint is not None:
+        saved = run_checkpoint.get("extract", (question, url))
+        if saved is not None:
+            print(f"Resumed the extraction of {url}")
+            return saved
 
     markdown_text, status = scrape_content_from_url(url)
     if status != "Success":
         print(f"Scraping failed. Status: {status}")
         return ""
 
-    current_response = ""
-    segment = ""
-    segment_token_count = 0
-    count = 0
-    for word in markdown_text.split(" "):
-        tentative_segment = f"{segment} {word}"
-        tentative_token_count = count_tokens(tentative_segment)
-        if tentative_token_count <= SMART_MODEL_MAX_TOKENS * 0.5:
-            segment = tentative_segment
-            segment_token_count = tentative_token_count
+    start_time = time.time()
+    if options.extract_mode in ("map-reduce", "delta"):
+        max_tokens = prompt_packer.budget(FAST_MODEL_NAME, count_message_tokens(segment_prompt(question, "")))
+    else:
+        # Half of the room goes to segments, the rest to the growing response, which is in both prompt and answer.
+        max_tokens = prompt_packer.budget(
+            FAST_MODEL_NAME, count_message_tokens(fold_prompt(question, "", "")), rewrite=True)
+    segments = prompt_packer.split(markdown_text, max_tokens)
+    with tracer.span("extract_page", url=url, segments=len(segments), mode=options.extract_mode):
+        if options.extract_mode == "map-reduce":
+            current_response = map_reduce_extract(question, url, segments, options.extract_concurrency)
+        elif options.extract_mode == "delta":
+            current_response = delta_extract(question, url, segments, options.extract_concurrency)
         else:
-            print(f"Processing page segment {count} for {url}")
-            current_response = extract_information_from_page(
-                question, url, current_response, segment)
-            segment = word
-            segment_token_count = count_tokens(segment)
-            count = count+1
-    if segment:
-        print(f"Processing page segment {count} for {url}")
-        current_response = extract_information_from_page(
-            question, url, current_response, segment)
-
+            current_response = ""
+            for count, segment in enumerate(segments):
+                if budget is not None and budget.stop_reason():
+                    print(f"Research budget spent, keeping {count} of {len(segments)} segments for {url}")
+                    break
+                if task_cancelled():
+                    print(f"Extraction of {url} timed out or was cancelled after {count} of {len(segments)} segments")
+                    break
+                print(f"Processing page segment {count} for {url}")
+                current_response = extract_information_from_page(
+                    question, url, current_response, segment)
+
+    print(f"Extracted {len(segments)} segments ({options.extract_mode}) in {time.time() - start_time:.1f}s for {url}")
+    if (run_checkpoint is not None and current_response and not task_cancelled()
+            and not (budget is not None and budget.stop_reason())):
+        run_checkpoint.put("extract", (question, url), current_response)
     return current_response
 
 
-def scrape_content_from_url(url: str) -> (str, str):
+def scrape_content_from_url(url: str, max_tokens: int = PAGE_MAX_TOKENS) -> (str, str):
     """
     Scrape the content of a web page and return it as Markdown-formatted text.
 
     Parameters:
     - url (str): The URL of the web page to scrape.
+    - max_tokens (int): Stop reading the page once this many tokens of Markdown have been produced.
 
     Returns:
     - str: The Markdown-formatted text content of the web page.
     - str: Status message indicating the outcome of the operation ("Success" or an error message).
 
-    Exceptions:
-    - Raises requests.exceptions.RequestException for issues like connectivity, timeout, etc.
+    Connectivity errors and timeouts are returned as the status rather than raised. Pages are fetched over the shared,
+    keep-alive `page_fetcher` client, which skips content that is not HTML and reads no more than PAGE_MAX_BYTES.
 
     Example Usage:
     >>> text, status = scrape_page('http://www.example.com')
@@ -178,40 +374,18 @@ def scrape_content_from_url(url: str) -> (str, str):
     >>>     print(f"Scraping failed. Status: {status}")
     """
 
-    try:
-        response = requests.get(
-            url,
-            headers={
-                'User-Agent': "Mozilla/5.0 (Android 13; Mobile; rv:109.0) Gecko/118.0 Firefox/118.0"
-            },
-            timeout=20,
-        )
-        if response.status_code // 100 == 2:
-            markdown_text = html_to_markdown(response.text)
-            return markdown_text, "Success"
-        else:
-            print(
-                f"Failed to fetch the webpage {url}. Status Code: {response.status_code}")
-            return "", f"Failed. Status Code: {response.status_code}"
-    except requests.exceptions.RequestException as err:
-        print(f"An error occurred: {err}")
-        return "", f"An error occurred: {err}"
-
-
-def consolidate_search_results(question: str, results: str, new_results: str) -> str:
-    """Combine and summarize multiple search results into one cohesive response."""
+    with tracer.span("scrape", url=url) as span:
+        text, status = page_fetcher.fetch(url, max_tokens=max_tokens)
+        span.set(status=status)
+    return text, status
 
-    max_retry = 2
-    retry = 0
-
-    original_response_length = count_tokens(results)
-    model_name = FAST_MODEL_NAME
 
-    while retry < max_retry:
-        msgs = [
-            {
-                "role": "system",
-                "content": f"""Your task is to consolidate and summarize search results for the question: '{question}'.
+def merge_prompt(question: str, results: str, new_results: str) -> list[dict]:
+    """Build the prompt that merges a new result into the current one."""
+    return [
+        {
+            "role": "system",
+            "content": f"""Your task is to consolidate and summarize search results for the question: '{question}'.
 
 Instructions:
 1. Combine the information from the 'Current Result' and the 'New Result'.
@@ -227,23 +401,138 @@ New Result:
 {new_results}
 
 Please proceed with the task."""
-            }
-        ]
+        }
+    ]
 
-        new_response = interact_with_openai_api(msgs, stream=False, model_name=model_name)[
-            "choices"][0]["message"]["content"]
 
-        if count_tokens(new_response) >= original_response_length * 0.85:
-            return new_response
+def merge_budget(question: str, model_name: str = FAST_MODEL_NAME) -> int:
+    """Tokens of results that fit in one merge prompt for `model_name`, current and new result together."""
+    return prompt_packer.budget(model_name, count_message_tokens(merge_prompt(question, "", "")), rewrite=True)
 
-        print(
-            f"Retry {retry+1}: New response is shorter than original. Retrying.")
-        retry += 1
-        if retry > 1:
-            model_name = SMART_MODEL_NAME
 
-    print("Max retries reached. Returning original result.")
-    return results  # if max retries are reached, return the original result
+def pack_for_merge(question: str, items: list[str], separator: str = "\n") -> list[str]:
+    """Pack results into batches that fit two to a merge prompt for the fast model."""
+    return prompt_packer.pack(items, merge_budget(question) // 2, separator)
+
+
+def consolidate_search_results(question: str, results: str, new_results: str, on_text=None,
+                               model_name: str = FAST_MODEL_NAME) -> str:
+    """
+    Combine and summarize multiple search results into one cohesive response.
+
+    With `on_text`, the response is streamed, and every piece of text is passed to `on_text` as it arrives. When the
+    new result does not fit beside the current one in the window of the model serving the call, as can happen once a
+    retry escalates to the smart model, it is re-packed into pieces that do and each piece is merged in turn.
+    """
+
+    max_retry = 3
+    retry = 0
+
+    original_response_length = count_tokens(results)
+    new_results_length = count_tokens(new_results)
+
+    with tracer.span("merge") as span:
+        while retry < max_retry:
+            span.set(retries=retry, escalated=model_name == SMART_MODEL_NAME)
+            room = merge_budget(question, model_name) - original_response_length
+            if new_results_length > room:
+                return merge_pieces(question, results, new_results, model_name, room, on_text)
+
+            msgs = merge_prompt(question, results, new_results)
+            new_response = complete_text(msgs, model_name=model_name, on_text=on_text)
+
+            if count_tokens(new_response) >= original_response_length * 0.85:
+                return new_response
+
+            print(
+                f"Retry {retry+1}: New response is shorter than original. Retrying.")
+            forget_response(msgs, model_name)
+            if on_text is not None:
+                on_text("\n\n[The response above dropped details, retrying]\n\n")
+            retry += 1
+            if retry > 1:
+                model_name = SMART_MODEL_NAME
+
+        span.set(retries=retry, failed=True)
+        print("Max retries reached. Returning original result.")
+        if on_text is not None:
+            on_text(f"\n\n[Keeping the result before the merge]\n\n{results}")
+        return results  # if max retries are reached, return the original result
+
+
+def merge_pieces(question: str, results: str, new_results: str, model_name: str, room: int, on_text=None) -> str:
+    """Merge a new result that is too large for `model_name` into the current one in pieces of at most `room` tokens."""
+    if room < MIN_CONTENT_TOKENS:
+        print(f"The current result leaves no room in the {model_name} window, keeping both results.")
+        if on_text is not None:
+            on_text(f"{results}\n\n{new_results}")
+        return f"{results}\n\n{new_results}"
+    pieces = prompt_packer.split(new_results, room)
+    print(f"Re-packed a result into {len(pieces)} pieces for {model_name}")
+    for count, piece in enumerate(pieces):
+        results = consolidate_search_results(question, results, piece,
+                                             on_text if count == len(pieces) - 1 else None, model_name)
+    return results
+
+
+def merge_pair(question: str, left: str, right: str, on_text=None) -> str:
+    """Merge two partial results, or join them unmerged when a merge prompt would not fit the fast model's window."""
+    if count_tokens(left) + count_tokens(right) > merge_budget(question):
+        print("Merge would exceed the token budget, keeping both results.")
+        if on_text is not None:
+            on_text(f"{left}\n\n{right}")
+        return f"{left}\n\n{right}"
+    return checkpointed("merge", (question, left, right),
+                        lambda: consolidate_search_results(question, left, right, on_text), on_text)
+
+
+def merge_bullets(answers: list[tuple], on_text=None) -> str:
+    """
+    Merge `(text, source)` answers into one list of source-tagged bullets locally, without an LLM call.
+
+    Bullets already tagged, such as those of an extracted page, keep their tag; the rest are tagged with the source.
+    """
+    merged = BulletList()
+    for text, source in answers:
+        merged.add_text(text, source)
+    print(f"Merged {len(answers)} results into {len(merged)} bullets")
+    result = merged.render()
+    if on_text is not None:
+        on_text(result)
+    return result
+
+
+def tree_consolidate(question: str, batches: list[str], max_workers: int = 4, on_text=None) -> str:
+    """
+    Consolidate batches of results by merging them in pairs, one level at a time.
+
+    Every merge in a level runs concurrently, so N batches take about log2(N) rounds of LLM calls instead of N calls
+    in a row, and no merge prompt carries more results than fit the fast model's window (see `merge_budget`). An odd batch at the end of a level is
+    carried up to the next level as is. Batches keep their order. With `on_text`, the last merge is streamed to it.
+    """
+    batches = [b for b in batches if b]
+    if not batches:
+        return ""
+    if len(batches) == 1:
+        return checkpointed("merge", (question, "", batches[0]),
+                            lambda: consolidate_search_results(question, "", batches[0], on_text), on_text)
+
+    level = 0
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        while len(batches) > 1:
+            level += 1
+            pairs = [(batches[i], batches[i + 1]) for i in range(0, len(batches) - 1, 2)]
+            print(f"Merging {len(batches)} results in {len(pairs)} pairs, level {level}")
+            with tracer.span("consolidate_level", level=level, pairs=len(pairs)):
+                if len(batches) == 2:
+                    merged = [merge_pair(question, *pairs[0], on_text=on_text)]
+                else:
+                    merged = list(executor.map(in_context(lambda pair: merge_pair(question, *pair)), pairs))
+            if len(batches) % 2:
+                merged.append(batches[-1])
+            batches = merged
+
+    return batches[0]
 
 
 def get_score(response: str) -> int:
@@ -254,13 +543,35 @@ def get_score(response: str) -> int:
     raise ValueError("No integer value found in the response.")
 
 
-def filter_results_in_threads(question, sliced_results, results, lock):
-    """Evaluate search results in parallel threads based on their relevance."""
-    for r in sliced_results:
-        msgs = [
-            {
-                "role": "system",
-                "content": f"""Task Description:
+class ScoringStats:
+    """Counts the LLM calls and prompt tokens spent on relevance scoring, against one call per result."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.results = 0
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.unbatched_prompt_tokens = 0
+
+    def add(self, results: int, calls: int, prompt_tokens: int, unbatched_prompt_tokens: int):
+        with self.lock:
+            self.results += results
+            self.calls += calls
+            self.prompt_tokens += prompt_tokens
+            self.unbatched_prompt_tokens += unbatched_prompt_tokens
+
+    def report(self) -> str:
+        return (f"Scored {self.results} results in {self.calls} calls, "
+                f"saved {self.results - self.calls} calls and "
+                f"{self.unbatched_prompt_tokens - self.prompt_tokens} prompt tokens")
+
+
+def score_prompt(question: str, r: dict) -> list[dict]:
+    """Build the prompt that scores a single search result."""
+    return [
+        {
+            "role": "system",
+            "content": f"""Task Description:
 
 You are a Search Result Relevancy Evaluator. Given a set of text inputs that represent the title, URL, and content of 
 a search result, you operate as a function that must compute and output an integer score that quantifies the search 
@@ -287,171 +598,462 @@ following: 0, 1, 2, 3, or 4. Any other type of response will result in a runtime
 
 Response:
 Score: """
-            }
-        ]
+        }
+    ]
 
-        response = interact_with_openai_api(msgs, stream=False)
-        score = get_score(response["choices"][0]["message"]["content"])
-        print(f"Score: {score}, URL: {r['href']}")
-        if score == 4:
-            extracted_info = extract_from_url(r['href'], question)
-            if count_tokens(extracted_info) > count_tokens(r['body']):
-                r['body'] = extracted_info
-        if score >= 3:
-            with lock:
-                results.append(r)
-            print(f"Added {r['href']}")
-
-
-def consolidate_results(all_results: list, question: str, query: str) -> str:
-    """Combine all relevant search results into a single response."""
-
-    results = []
-    lock = threading.Lock()
-
-    num_threads = 4
-    if num_threads > len(all_results):
-        num_threads = len(all_results)
-    slice_size = len(all_results) // num_threads
-    threads = []
-    for i in range(num_threads):
-        start_index = i * slice_size
-        end_index = start_index + slice_size
-        sliced_results = all_results[start_index:end_index]
-        t = threading.Thread(target=filter_results_in_threads, args=(question, sliced_results, results, lock))
-        threads.append(t)
-        t.start()
-
-    for t in threads:
-        t.join()
-
-    response = ""
-    combine_input = []
-    for r in results:
-        combine_input.append(
-            f"\n\nTitle: {r['title']}\nURL: {r['href']}\nContent: {r['body']}")
-        if count_tokens("\n".join(combine_input)) > SMART_MODEL_MAX_TOKENS * 0.5:
-            print("processing...")
-            response = consolidate_search_results(
-                question, response, "\n".join(combine_input))
-            combine_input = []
-
-    if combine_input:
-        print("processing...")
-        response = consolidate_search_results(
-            question, response, "\n".join(combine_input))
 
-    return response
+def batch_score_prompt(question: str, batch: list[dict]) -> list[dict]:
+    """Build the prompt that scores several search results at once, identified by their position from 1."""
+    listing = "\n\n".join(
+        f"Result ID: {i}\n  Title: {r['title']}\n  URL: {r['href']}\n  Content: {r['body']}"
+        for i, r in enumerate(batch, start=1))
+    return [
+        {
+            "role": "system",
+            "content": f"""Task Description:
 
+You are a Search Result Relevancy Evaluator. Given a numbered list of search results, each with a title, URL, and 
+content, you operate as a function that must compute an integer score for every result that quantifies its relevance 
+to a specific user query.
 
-def web_search(question: str, query: str, max_results: int = 250) -> str:
-    """Conduct a web search and return a consolidated result."""
+Task Requirements:
+- Evaluate each search result on its own in the context of its relevance to the query '{question}'.
+- Score every result with an INTEGER value that falls within the inclusive range of 0 to 4.
+- STRICTLY output ONLY a JSON object that maps every Result ID to its score, for example: {{"1": 4, "2": 0}}
+- Include every Result ID exactly once, and nothing other than the JSON object.
 
-    max_retry = 5
-    retry = 0
-    all_results = []
-    while retry <= max_retry:
-        with DDGS() as ddgs:
-            all_results = [r for r in ddgs.text(
-                query, region="us-en", safesearch="off", max_results=max_results, backend="lite")]
-            if len(all_results) > 0:
-                break
-        retry += 1
+Search Results:
 
-    print(f"Found {len(all_results)} web results to process")
-    return consolidate_results(all_results, question, query)
+{listing}
+
+Response:
+"""
+        }
+    ]
 
 
-def execute_wikipedia_search(question: str, query: str, max_results: int = 250) -> str:
-    """Search Wikipedia for relevant articles and return a consolidated result."""
-    all_results = []
-    for page_title in wikipedia.search(query[:300]):
+def parse_batch_scores(response: str, batch_size: int) -> dict[int, int]:
+    """
+    Return the valid scores from a batch scoring reply, keyed by the position of the result in the batch.
+
+    IDs that are missing, out of range, or scored with anything other than an integer from 0 to 4 are left out.
+    """
+    match = re.search(r'\{.*\}', response, re.DOTALL)
+    if not match:
+        return {}
+    try:
+        reply = json.loads(match.group())
+    except json.JSONDecodeError:
+        return {}
+    if not isinstance(reply, dict):
+        return {}
+
+    scores = {}
+    for key, value in reply.items():
         try:
-            wiki_page = wikipedia.page(title=page_title, auto_suggest=False)
-        except (wikipedia.exceptions.PageError, wikipedia.exceptions.DisambiguationError):
+            result_id = int(key)
+        except (TypeError, ValueError):
+            continue
+        if isinstance(value, str) and value.strip().isdigit():
+            value = int(value)
+        if isinstance(value, bool) or not isinstance(value, int):
             continue
+        if 1 <= result_id <= batch_size and 0 <= value <= 4:
+            scores[result_id - 1] = value
+    return scores
 
-        all_results.append({
-            "title": page_title,
-            "href": wiki_page.url,
-            "body": wiki_page.summary,
-        })
-        if len(all_results) >= max_results:
-            break
-    print(f"Found {len(all_results)} wikipedia results to process")
 
-    return consolidate_results(all_results, question, query)
+def score_result(question: str, r: dict, stats: ScoringStats) -> int:
+    """Score one search result with its own LLM call."""
+    msgs = score_prompt(question, r)
+    prompt_tokens = count_tokens(msgs[0]["content"])
+    stats.add(0, 1, prompt_tokens, 0)
+    with tracer.span("score", results=1):
+        response = interact_with_openai_api(msgs, stream=False)
+    try:
+        return get_score(response["choices"][0]["message"]["content"])
+    except ValueError as err:
+        print(f"Invalid score for {r['href']}: {err}")
+        return 0
+
+
+def score_results(question: str, batch: list[dict], stats: ScoringStats) -> list[int]:
+    """Score a batch of search results, reusing the scores an earlier attempt of this run checkpointed."""
+    if run_checkpoint is None:
+        return score_batch(question, batch, stats)
+    saved = [run_checkpoint.get("score", (question, r['href'])) for r in batch]
+    if None not in saved:
+        return saved
+    scores = score_batch(question, batch, stats)
+    for r, score in zip(batch, scores):
+        run_checkpoint.put("score", (question, r['href']), score)
+    return scores
+
+
+def score_batch(question: str, batch: list[dict], stats: ScoringStats) -> list[int]:
+    """Score a batch of search results with one LLM call, scoring any result without a valid score on its own."""
+    unbatched_prompt_tokens = sum(count_tokens(score_prompt(question, r)[0]["content"]) for r in batch)
+    if len(batch) == 1:
+        stats.add(1, 0, 0, unbatched_prompt_tokens)
+        return [score_result(question, batch[0], stats)]
+
+    msgs = batch_score_prompt(question, batch)
+    stats.add(len(batch), 1, count_tokens(msgs[0]["content"]), unbatched_prompt_tokens)
+    with tracer.span("score", results=len(batch)) as span:
+        response = interact_with_openai_api(msgs, stream=False)
+        scores = parse_batch_scores(response["choices"][0]["message"]["content"], len(batch))
 
+        if len(scores) < len(batch):
+            print(f"Batch reply had {len(scores)} valid scores for {len(batch)} results, rescoring the rest")
+            span.set(rescored=len(batch) - len(scores))
+        return [scores[i] if i in scores else score_result(question, r, stats) for i, r in enumerate(batch)]
 
-def interact_with_openai_api(msgs: list[dict], functions: list[dict] = None, stream: bool = True, model_name: str = FAST_MODEL_NAME):
-    """Call the OpenAI API and handle any potential errors."""
-    max_retry = 7
-    retry = 0
-    while True:
+
+def consolidate_results(all_results: list, question: str, query: str, options: ResearchOptions = None,
+                        on_text=None) -> str:
+    """
+    Combine all relevant search results into a single response.
+
+    Extracted pages are written to `progress` as they finish, when it is set, and the final merge is streamed to
+    `on_text`, when it is given.
+
+    With a `research_budget`, results are scored best ranked first, and scoring and extraction stop as soon as the
+    budget says so. Results that scored 4 but were not extracted by then are kept as search results, and what was found
+    is consolidated.
+    """
+
+    options = options or ResearchOptions()
+    stats = ScoringStats()
+    batch_size = max(1, options.score_batch_size)
+    budget = research_budget.get()
+    kept = {}
+
+    with tracer.span("rank", results=len(all_results)):
+        all_results = dedupe_results(all_results)
+        ranked_results = rank_results(question, all_results, options.rank_top_k, options.rank_min_score,
+                                      keep_order=budget is None or not budget.limited)
+    if len(ranked_results) < len(all_results):
+        avoided_calls = math.ceil(len(all_results) / batch_size) - math.ceil(len(ranked_results) / batch_size)
+        print(f"Lexical ranking kept {len(ranked_results)} of {len(all_results)} results, "
+              f"avoided {avoided_calls} scoring calls")
+    all_results = ranked_results
+
+    # Scoring and extraction share one work queue, so a result that scores 4 is extracted while the rest are still
+    # being scored. Results are keyed by their position in all_results to keep the final order. Tasks are fed to the
+    # queue no more than pool_size at a time, so a waiting extraction never sits behind every remaining score batch:
+    # whenever a worker frees up it takes the best ranked result waiting for extraction, or else the next score batch.
+    pending_scores = deque(range(0, len(all_results), batch_size))
+    pending_extracts = []
+    in_flight = 0
+    stopped = False
+    with WorkQueue(options.pool_size, options.task_timeout) as queue:
+
+        def feed():
+            nonlocal in_flight
+            while not stopped and in_flight < options.pool_size and (pending_extracts or pending_scores):
+                if pending_extracts:
+                    position = heapq.heappop(pending_extracts)
+                    queue.submit(extract_from_url, all_results[position]['href'], question, options,
+                                 key=("extract", position))
+                else:
+                    start = pending_scores.popleft()
+                    queue.submit(score_results, question, all_results[start:start + batch_size], stats,
+                                 key=("score", start))
+                in_flight += 1
+
+        feed()
+        for (stage, index), future in queue.as_completed():
+            in_flight -= 1
+            if future.cancelled():
+                if stage == "extract":
+                    # Cancelled before it started: keep the search result, as for results never extracted.
+                    kept[index] = all_results[index]
+                continue
+            if stage == "score":
+                batch = all_results[index:index + batch_size]
+                try:
+                    scores = future.result()
+                except Exception as err:
+                    print(f"Scoring failed for {len(batch)} results: {err!r}")
+                    continue
+                for offset, (r, score) in enumerate(zip(batch, scores)):
+                    print(f"Score: {score}, URL: {r['href']}")
+                    if score == 4:
+                        heapq.heappush(pending_extracts, index + offset)
+                    elif score >= 3:
+                        kept[index + offset] = r
+                        print(f"Added {r['href']}")
+            else:
+                r = all_results[index]
+                try:
+                    extracted_info = future.result()
+                    if count_tokens(extracted_info) > count_tokens(r['body']):
+                        r['body'] = extracted_info
+                    if progress is not None:
+                        progress.source(r['title'], r['href'], extracted_info)
+                    if budget is not None and extracted_info.strip():
+                        budget.add_source(extracted_info)
+                except Exception as err:
+                    print(f"Extraction failed for {r['href']}, keeping the search result: {err!r}")
+                kept[index] = r
+                print(f"Added {r['href']}")
+
+            if not stopped and budget is not None and budget.stop_reason():
+                print(f"Stopping research early because {budget.stop_reason()}, consolidating what was found")
+                queue.cancel()
+                stopped = True
+            feed()
+    print(stats.report())
+    for position in pending_extracts:
+        kept[position] = all_results[position]
+
+    results = [kept[i] for i in sorted(kept)]
+    results = dedupe_texts(results, "extracted results", key=lambda r: r['body'])
+    if options.extract_mode == "delta":
+        return merge_bullets([(r['body'], r['href']) for r in results], on_text)
+    combine_input = [
+        f"\n\nTitle: {r['title']}\nURL: {r['href']}\nContent: {r['body']}" for r in results]
+    print("processing...")
+    return tree_consolidate(question, pack_for_merge(question, combine_input), options.merge_concurrency, on_text)
+
+
+def cached_search(source: str, query: str, max_results: int, search) -> list[dict]:
+    """
+    Run `search()` once per source, query and result count for the life of the process.
+
+    Results come from an earlier search by any question of the run, or from the run checkpoint, before `search` is
+    called. A caller that asks for a search another question is still running waits for that one instead of starting
+    its own. Searches that do run take one of the `search_slots`; a search that fails or finds nothing is not kept.
+    Every caller gets its own copy of the results, which consolidation edits in place.
+    """
+    key = (source, query, max_results)
+    with search_cache_lock:
+        future = search_cache.get(key)
+        running = future is None
+        if running:
+            future = search_cache[key] = Future()
+    if running:
         try:
-            create_params = {
-                'model': model_name,
-                'messages': msgs,
-                'stream': stream,
-            }
-            if functions is not None:
-                create_params['functions'] = functions
-            completion = openai.ChatCompletion.create(
-                headers={
-                    "HTTP-Referer": "http://localhost",
-                    "X-Title": "localhost",
-                },
-                **create_params)
-            if not stream and bool(os.getenv("DEBUG", "")):
-                print(json.dumps(msgs, indent=2, sort_keys=True))
-                print(json.dumps(completion, indent=2, sort_keys=True))
-            return completion
-        except Exception as api_err:
-            print(f'\n\nError communicating with OpenAI: "{api_err}"')
-            retry += 1
-            if retry >= max_retry:
-                raise api_err
-            print(f'\n\nRetrying in {2 ** (retry - 1) * 5} seconds...')
-            sleep(2 ** (retry - 1) * 10)
+            results = run_checkpoint.get("search", key) if run_checkpoint is not None else None
+            if results is None:
+                with search_slots:
+                    results = search()
+                if run_checkpoint is not None and results:
+                    run_checkpoint.put("search", key, results)
+        except BaseException as err:
+            with search_cache_lock:
+                del search_cache[key]
+            future.set_exception(err)
+            raise
+        if not results:
+            with search_cache_lock:
+                del search_cache[key]
+        future.set_result(results)
+    return copy.deepcopy(future.result())
+
+
+def web_search(question: str, query: str, max_results: int = 250, options: ResearchOptions = None,
+               on_text=None) -> str:
+    """Conduct a web search and return a consolidated result."""
+
+    def search():
+        max_retry = 5
+        retry = 0
+        all_results = []
+        with tracer.span("web_search") as span:
+            while retry <= max_retry:
+                with DDGS() as ddgs:
+                    all_results = [r for r in ddgs.text(
+                        query, region="us-en", safesearch="off", max_results=max_results, backend="lite")]
+                    if len(all_results) > 0:
+                        break
+                retry += 1
+            span.set(retries=retry, results=len(all_results))
+        return all_results
+
+    all_results = cached_search("web", query, max_results, search)
+    print(f"Found {len(all_results)} web results to process")
+    return consolidate_results(all_results, question, query, options, on_text)
 
 
-def _start():
+def execute_wikipedia_search(question: str, query: str, max_results: int = 250,
+                             options: ResearchOptions = None, on_text=None) -> str:
     """
-    Initiates the main execution of the program.
+    Search Wikipedia for relevant articles and return a consolidated result.
 
-    This function performs the following tasks:
-    1. Defines a question regarding dispersed camping sites in Utah.
-    2. Queries an expert web research agent to generate a relevant search query.
-    3. Executes a web search using the generated query.
-    4. Generates a Wikipedia-specific query for the same question.
-    5. Searches Wikipedia using the generated query.
-    6. Consolidates the results from the web and Wikipedia searches and prints them.
+    WIKI_SEARCH_HEADROOM more titles than `max_results` are searched, since missing and disambiguation pages are left
+    out, and the list is cut to `max_results` after they are.
+    """
 
-    Note: This function is intended for internal use and should not be imported or called externally.
+    def search():
+        with tracer.span("wikipedia_search") as span:
+            titles = wiki_client.search(query[:300], limit=max_results + WIKI_SEARCH_HEADROOM)
+            pages = wiki_client.summaries(titles)
+            all_results = [{
+                "title": page_title,
+                "href": wiki_page.url,
+                "body": wiki_page.summary,
+            } for page_title, wiki_page in pages.items() if wiki_page is not None][:max_results]
+            span.set(results=len(all_results))
+        return all_results
+
+    all_results = cached_search("wikipedia", query, max_results, search)
+    print(f"Found {len(all_results)} wikipedia results to process")
+
+    return consolidate_results(all_results, question, query, options, on_text)
+
+
+def complete_text(msgs: list[dict], model_name: str = FAST_MODEL_NAME, on_text=None) -> str:
     """
+    Return the text of a chat completion.
 
-    parser = argparse.ArgumentParser(
-        description="Search the web and Wikipedia based on user query.")
-    parser.add_argument("--web", type=int,
-                        help="Number of web search results", default=10)
-    parser.add_argument("--wiki", type=int,
-                        help="Number of Wikipedia search results", default=0)
-    args = parser.parse_args()
+    With `on_text`, the completion is streamed and each piece of text is passed to `on_text` as it arrives; a cached
+    response is passed whole. Streamed responses are stored in `llm_cache` like any other. If the stream breaks off,
+    the request is sent again without streaming and its text is passed on after a notice.
+    """
+    if on_text is None:
+        return interact_with_openai_api(msgs, stream=False, model_name=model_name)["choices"][0]["message"]["content"]
 
-    print(f"Fast model {FAST_MODEL_NAME}:{FAST_MODEL_MAX_TOKENS}")
-    print(f"Smart model {SMART_MODEL_NAME}:{SMART_MODEL_MAX_TOKENS}")
+    key = cache_key(model_name, msgs) if llm_cache is not None else None
+    cached = llm_cache.get(key) if key is not None else None
+    if cached is not None:
+        text = cached["choices"][0]["message"]["content"]
+        on_text(text)
+        return text
 
-    while True:
-        question = input("Enter your question: ")
-        if question != "":
-            break
-
-    web_result = ""
-    if args.web > 0:
-        msgs = [
-            {
-                "role": "system",
-                "content": f"""You're an expert web research agent. 
+    pieces = []
+    try:
+        for chunk in interact_with_openai_api(msgs, stream=True, model_name=model_name):
+            if not chunk["choices"]:
+                continue
+            piece = chunk["choices"][0]["delta"].get("content")
+            if piece:
+                pieces.append(piece)
+                on_text(piece)
+    except Exception as err:
+        print(f"\n\nStreaming failed, requesting the whole response: {err!r}")
+        on_text("\n\n[Stream interrupted, restarting]\n\n")
+        text = interact_with_openai_api(msgs, stream=False, model_name=model_name,
+                                        cache=key is not None)["choices"][0]["message"]["content"]
+        on_text(text)
+        return text
+
+    text = "".join(pieces)
+    completion_tokens = count_tokens(text)
+    rate_limiter.debit(model_name, completion_tokens)
+    prompt_tokens = count_message_tokens(msgs)
+    budget = research_budget.get()
+    if budget is not None:
+        budget.record(model_name, prompt_tokens, completion_tokens)
+    if key is not None:
+        llm_cache.put(key, {
+            "object": "chat.completion",
+            "model": model_name,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        })
+    return text
+
+
+def forget_response(msgs: list[dict], model_name: str = FAST_MODEL_NAME):
+    """
+    Drop a rejected response from `llm_cache`, so that retrying the same prompt asks the model again instead of
+    getting the same response back, and a later run does not reuse it either.
+    """
+    if llm_cache is not None:
+        llm_cache.delete(cache_key(model_name, msgs))
+
+
+def count_message_tokens(msgs: list[dict], functions: list[dict] = None) -> int:
+    """Estimate the prompt tokens of a chat completion request, including per-message overhead."""
+    tokens = sum(count_tokens(m.get("content") or "") + 4 for m in msgs) + 3
+    if functions is not None:
+        tokens += count_tokens(json.dumps(functions))
+    return tokens
+
+
+def interact_with_openai_api(msgs: list[dict], functions: list[dict] = None, stream: bool = True,
+                             model_name: str = FAST_MODEL_NAME, cache: bool = True):
+    """
+    Call the OpenAI API and handle any potential errors.
+
+    Non-streaming responses are served from and stored in `llm_cache`, unless `cache` is False. Pass False for prompts
+    that must get a fresh answer every time. No more than LLM_CONCURRENCY requests are sent at once; a request waits
+    for its model's rate limit before it takes a slot, so a model held back by its limit does not keep other models'
+    requests from being sent, and a streaming request gives up its slot once the stream has started. Each call is traced as an "llm" span with its token usage
+    and retries.
+    """
+    with tracer.span("llm", model=model_name) as span:
+        key = None
+        if cache and not stream and llm_cache is not None:
+            key = cache_key(model_name, msgs, functions)
+            cached = llm_cache.get(key)
+            if cached is not None:
+                span.set(cached=True)
+                return openai.util.convert_to_openai_object(cached)
+
+        prompt_tokens = count_message_tokens(msgs, functions)
+        span.set(prompt_tokens=prompt_tokens, stream=stream)
+        max_retry = 7
+        retry = 0
+        while True:
+            try:
+                create_params = {
+                    'model': model_name,
+                    'messages': msgs,
+                    'stream': stream,
+                }
+                if functions is not None:
+                    create_params['functions'] = functions
+                span.add("rate_limit_wait", rate_limiter.acquire(model_name, prompt_tokens))
+                with llm_slots:
+                    completion = openai.ChatCompletion.create(
+                        headers={
+                            "HTTP-Referer": "http://localhost",
+                            "X-Title": "localhost",
+                        },
+                        **create_params)
+                if not stream and bool(os.getenv("DEBUG", "")):
+                    print(json.dumps(msgs, indent=2, sort_keys=True))
+                    print(json.dumps(completion, indent=2, sort_keys=True))
+                if not stream:
+                    usage = completion.get("usage", {})
+                    span.set(prompt_tokens=usage.get("prompt_tokens", prompt_tokens),
+                             completion_tokens=usage.get("completion_tokens", 0))
+                    rate_limiter.debit(model_name, usage.get("completion_tokens", 0))
+                    budget = research_budget.get()
+                    if budget is not None:
+                        budget.record(model_name, usage.get("prompt_tokens", prompt_tokens),
+                                      usage.get("completion_tokens", 0))
+                if key is not None:
+                    llm_cache.put(key, completion)
+                return completion
+            except Exception as api_err:
+                print(f'\n\nError communicating with OpenAI: "{api_err}"')
+                retry += 1
+                span.set(retries=retry)
+                if retry >= max_retry:
+                    raise api_err
+                delay = backoff_delay(retry, base=10, cap=320,
+                                      retry_after=retry_after_seconds(getattr(api_err, "headers", None)))
+                budget = research_budget.get()
+                if budget is not None and budget.out_of_time(delay):
+                    print("Not retrying, the research time budget would run out first.")
+                    raise api_err
+                if isinstance(api_err, openai.error.RateLimitError):
+                    # Hold every caller of this model, not just this one, so they do not all hit the limit again.
+                    rate_limiter.pause(model_name, delay)
+                print(f'\n\nRetrying in {delay:.1f} seconds...')
+                sleep(delay)
+
+
+def research_web(question: str, max_results: int, options: ResearchOptions = None, on_text=None) -> str:
+    """Generate a web search query for the question with the smart model, then search and consolidate the results."""
+    msgs = [
+        {
+            "role": "system",
+            "content": f"""You're an expert web research agent. 
 Your goal is to intuit the core interest behind the user's question and generate a web search query that 
 captures that interest in the most relevant and specific manner. Consider the nuances of the question 
 and provide a tailored query. 
@@ -459,51 +1061,352 @@ and provide a tailored query.
 For the question: '{question}', what would be the most appropriate search query? 
 
 Please avoid using quotes around the query."""
-            }
-        ]
-        response = interact_with_openai_api(
-            msgs, stream=False, model_name=SMART_MODEL_NAME)
-        search_query = response["choices"][0]["message"]["content"]
-        print(f"Search query: {search_query}")
-        web_result = web_search(question, search_query, max_results=args.web)
+        }
+    ]
+    with tracer.span("query_generation", source="web"):
+        search_query = checkpointed("query", (question, "web"), lambda: interact_with_openai_api(
+            msgs, stream=False, model_name=SMART_MODEL_NAME)["choices"][0]["message"]["content"])
+    print(f"Search query: {search_query}")
+    return web_search(question, search_query, max_results=max_results, options=options, on_text=on_text)
 
-    wikipedia_result = ""
-    if args.wiki > 0:
-        msgs = [
-            {
-                "role": "system",
-                "content": f"""You're tasked with generating a query for Wikipedia, an encyclopedia. Think of topics or subject areas that Wikipedia is likely to have comprehensive articles on. The query should be tailored to retrieve relevant and in-depth information on the topic at hand.
+
+def research_wikipedia(question: str, max_results: int, options: ResearchOptions = None, on_text=None) -> str:
+    """Generate a Wikipedia query for the question with the smart model, then search and consolidate the results."""
+    msgs = [
+        {
+            "role": "system",
+            "content": f"""You're tasked with generating a query for Wikipedia, an encyclopedia. Think of topics or subject areas that Wikipedia is likely to have comprehensive articles on. The query should be tailored to retrieve relevant and in-depth information on the topic at hand.
 
 Considering the question: '{question}', what would be the most encyclopedic search query for Wikipedia? 
 
 Please provide the query without enclosing it in quotes."""
-            }
-        ]
-        response = interact_with_openai_api(
-            msgs, stream=False, model_name=SMART_MODEL_NAME)
-        search_query = response["choices"][0]["message"]["content"]
-        wikipedia_result = execute_wikipedia_search(
-            question, search_query, max_results=args.wiki)
+        }
+    ]
+    with tracer.span("query_generation", source="wikipedia"):
+        search_query = checkpointed("query", (question, "wikipedia"), lambda: interact_with_openai_api(
+            msgs, stream=False, model_name=SMART_MODEL_NAME)["choices"][0]["message"]["content"])
+    return execute_wikipedia_search(question, search_query, max_results=max_results, options=options,
+                                    on_text=on_text)
+
+
+def research_question(question: str, web_results: int, wiki_results: int, options: ResearchOptions = None,
+                      on_text=None) -> str:
+    """
+    Research a question on the web and on Wikipedia, and merge the two answers.
+
+    The web and Wikipedia branches do not depend on each other, so both run at once, from query generation on. They
+    share the process-wide LLM concurrency budget, and the final merge starts when the slower one finishes. With one
+    branch, that branch's last merge is the answer and is streamed to `on_text`; with both, the merge of the two is,
+    and each branch's answer is written to `progress` as a partial answer. A branch that fails is left out.
+    """
+    options = options or ResearchOptions()
+    branch_on_text = on_text if (web_results > 0) != (wiki_results > 0) else None
+    branches = {}
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        if web_results > 0:
+            branches[executor.submit(in_context(research_web), question, web_results, options,
+                                     branch_on_text)] = "web"
+        if wiki_results > 0:
+            branches[executor.submit(in_context(research_wikipedia), question, wiki_results, options,
+                                     branch_on_text)] = "wikipedia"
+        results = {}
+        for future in as_completed(branches):
+            name = branches[future]
+            try:
+                results[name] = future.result()
+            except Exception as err:
+                print(f"The {name} research failed: {err!r}")
+                continue
+            if progress is not None and branch_on_text is None:
+                progress.source(f"Partial answer from {name} research", "", results[name])
+    web_result = results.get("web", "")
+    wikipedia_result = results.get("wikipedia", "")
 
-    result = web_result
     if len(wikipedia_result) > 0 and len(web_result) > 0:
-        result = consolidate_search_results(
-            question, web_result, wikipedia_result)
-    elif len(wikipedia_result) > 0:
-        result = wikipedia_result
+        if options.extract_mode == "delta":
+            return merge_bullets([(web_result, ""), (wikipedia_result, "")], on_text)
+        with tracer.span("final_merge"):
+            return merge_pair(question, web_result, wikipedia_result, on_text=on_text)
+    return web_result or wikipedia_result
+
+
+def research_batch(input_path: str, output_path: str, web_results: int, wiki_results: int,
+                   options: ResearchOptions = None, max_workers: int = 4, budget_limits: dict = None) -> int:
+    """
+    Research every question in a JSONL file, several at once, and write one JSON line per question as it finishes.
+
+    Each input line is an object with a "question"; its other fields, such as an id, are copied to its output line,
+    along with the input "line" number, the "answer", and the question's wall time, LLM calls, tokens and estimated
+    cost. A question that fails gets an "error" instead of an answer. The questions share the process-wide LLM and
+    search concurrency limits, rate limits, connection pools, and the page, Wikipedia, search and LLM response caches.
+    Each question has its own research budget, built from `budget_limits`. Returns the number of questions answered.
+
+    Example Usage:
+    >>> research_batch("questions.jsonl", "answers.jsonl", web_results=10, wiki_results=5, max_workers=8)
+    """
+    with open(input_path) as file:
+        items = [json.loads(line) for line in file if line.strip()]
 
-    print("Search complete\n\n")
-    print(result)
+    def research_item(line: int, item: dict) -> dict:
+        budget = ResearchBudget(**(budget_limits or {}))
+        research_budget.set(budget)
+        record = dict(item, line=line)
+        try:
+            record["answer"] = research_question(item["question"], web_results, wiki_results, options)
+        except Exception as err:
+            record["error"] = repr(err)
+        record.update(seconds=round(budget.elapsed(), 2), llm_calls=budget.calls,
+                      prompt_tokens=budget.prompt_tokens, completion_tokens=budget.completion_tokens,
+                      estimated_cost=round(budget.cost, 4))
+        if budget.stopped:
+            record["stopped_early"] = budget.stopped
+        return record
+
+    answered = 0
+    started = time.time()
+    with open(output_path, "w") as output, ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, research_item, line, item)
+                   for line, item in enumerate(items, 1)]
+        for count, future in enumerate(as_completed(futures), 1):
+            record = future.result()
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output.flush()
+            answered += "error" not in record
+            print(f"Finished {count} of {len(items)} questions in {time.time() - started:.0f}s "
+                  f"({record['seconds']}s, {record['llm_calls']} LLM calls): {record.get('question')}")
+    return answered
+
+
+def result_file_name(question: str) -> str:
+    """Ask the smart model for a file name for the answer to a question, and return it with a timestamped prefix."""
     msgs = [
         {
             "role": "system",
             "content": f"""Provide a file name in snake case, ending in .txt, for to save the answer to this user question: '{question}'."""
         }
     ]
-    response = interact_with_openai_api(
-        msgs, stream=False, model_name=SMART_MODEL_NAME)
-    file_name = response["choices"][0]["message"]["content"]
-    save_to_file(f"research_result_{int(time.time())}_{file_name}", result)
+
+    def name_file():
+        response = interact_with_openai_api(
+            msgs, stream=False, model_name=SMART_MODEL_NAME, cache=False)
+        file_name = response["choices"][0]["message"]["content"]
+        return f"research_result_{int(time.time())}_{file_name}"
+    return checkpointed("file_name", (question,), name_file)
+
+
+def given_options(parser: argparse.ArgumentParser) -> set:
+    """Return the names of the options given on the command line, as opposed to left at their defaults."""
+    defaults = {action.dest: action.default for action in parser._actions}
+    try:
+        for action in parser._actions:
+            action.default = argparse.SUPPRESS
+        return set(vars(parser.parse_args()))
+    finally:
+        for action in parser._actions:
+            action.default = defaults[action.dest]
+
+
+def _start():
+    """
+    Initiates the main execution of the program.
+
+    This function performs the following tasks:
+    1. Asks the user for a question.
+    2. At the same time, generates a web search query and runs the web search, and generates a Wikipedia-specific
+       query and searches Wikipedia, each with its own query.
+    3. Consolidates the results from the web and Wikipedia searches, once both are done, and prints them.
+
+    With `--batch FILE`, the questions come from a JSONL file instead, and are researched several at once by
+    `research_batch`.
+
+    Every finished stage is checkpointed under RUNS_DIR, so `--resume RUN_ID` continues an interrupted run with the
+    same question, or the same batch, instead of asking for one.
+
+    Note: This function is intended for internal use and should not be imported or called externally.
+    """
+    global llm_cache, llm_slots, progress, run_checkpoint
+
+    parser = argparse.ArgumentParser(
+        description="Search the web and Wikipedia based on user query.")
+    parser.add_argument("--web", type=int,
+                        help="Number of web search results", default=10)
+    parser.add_argument("--wiki", type=int,
+                        help="Number of Wikipedia search results", default=0)
+    parser.add_argument("--extract-mode", choices=EXTRACT_MODES, default=ResearchOptions.extract_mode,
+                        help="How page segments are extracted: 'fold' merges each segment into the running response "
+                             "in order, 'map-reduce' extracts all segments concurrently and merges the results, "
+                             "'delta' extracts all segments concurrently and merges the bullets of every page and "
+                             "result locally, tagged with their source, without merge prompts")
+    parser.add_argument("--extract-concurrency", type=int, default=ResearchOptions.extract_concurrency,
+                        help="Maximum concurrent segment extractions per page in map-reduce mode")
+    parser.add_argument("--score-batch-size", type=int, default=ResearchOptions.score_batch_size,
+                        help="Number of search results scored per LLM call, 1 scores each result on its own")
+    parser.add_argument("--pool-size", type=int, default=ResearchOptions.pool_size,
+                        help="Number of workers scoring and extracting search results")
+    parser.add_argument("--task-timeout", type=float, default=ResearchOptions.task_timeout,
+                        help="Seconds before a scoring or extraction task is abandoned, 0 for no limit")
+    parser.add_argument("--rank-top-k", type=int, default=ResearchOptions.rank_top_k,
+                        help="Number of results, ranked locally with BM25 against the question, sent to LLM scoring; "
+                             "0 sends every result")
+    parser.add_argument("--rank-min-score", type=float, default=ResearchOptions.rank_min_score,
+                        help="Drop results whose BM25 score is below this fraction of the best score")
+    parser.add_argument("--no-page-cache", action="store_true",
+                        help="Download every page instead of using the on-disk page cache")
+    parser.add_argument("--no-wiki-cache", action="store_true",
+                        help="Fetch every Wikipedia summary instead of using the on-disk summary cache")
+    parser.add_argument("--no-llm-cache", action="store_true",
+                        help="Send every LLM call to the API instead of using the on-disk response cache")
+    parser.add_argument("--merge-concurrency", type=int, default=ResearchOptions.merge_concurrency,
+                        help="Maximum concurrent merges in each level of result consolidation")
+    parser.add_argument("--llm-concurrency", type=int, default=int(os.getenv("LLM_CONCURRENCY", "8")),
+                        help="Maximum LLM requests in flight at once, shared by the web and Wikipedia research")
+    parser.add_argument("--stream", action="store_true",
+                        help="Print each extracted source and the answer as they arrive, writing them to the result "
+                             "file as they go")
+    parser.add_argument("--max-tokens", type=int, default=0,
+                        help="Stop researching once LLM calls have used this many tokens, 0 for no limit")
+    parser.add_argument("--max-cost", type=float, default=0.0,
+                        help="Stop researching once LLM calls have cost this many USD, estimated from FAST_MODEL_PRICE "
+                             "and SMART_MODEL_PRICE (\"prompt,completion\" per 1000 tokens), 0 for no limit")
+    parser.add_argument("--max-time", type=float, default=0.0,
+                        help="Stop researching once the run has taken this many seconds, 0 for no limit")
+    parser.add_argument("--max-llm-calls", type=int, default=0,
+                        help="Stop researching once this many LLM calls have been made, 0 for no limit")
+    parser.add_argument("--budget-reserve", type=float, default=0.2,
+                        help="Share of each budget kept for consolidating what was found")
+    parser.add_argument("--min-novelty", type=float, default=0.0,
+                        help="Stop researching once several sources in a row each add less than this share of new "
+                             "content, 0 to never stop for this")
+    parser.add_argument("--novelty-patience", type=int, default=3,
+                        help="Number of sources in a row below --min-novelty before research stops")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="Research every question in a JSONL file of {\"question\": ...} objects, several at once, "
+                             "instead of asking for one")
+    parser.add_argument("--output", metavar="FILE", default="research_results.jsonl",
+                        help="JSONL file the batch answers are written to as they finish")
+    parser.add_argument("--batch-concurrency", type=int, default=4,
+                        help="Number of batch questions researched at once")
+    parser.add_argument("--resume", metavar="RUN_ID",
+                        help="Resume an interrupted run, skipping the stages it already finished")
+    parser.add_argument("--no-checkpoint", action="store_true",
+                        help="Do not checkpoint finished stages, so the run cannot be resumed")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="Trace every stage and LLM call and write the spans to FILE as JSON")
+    parser.add_argument("--chrome-trace", metavar="FILE",
+                        help="Trace every stage and LLM call and write FILE in Chrome trace format, for "
+                             "chrome://tracing or Perfetto")
+    args = parser.parse_args()
+
+    # A resumed run keeps the options it was started with, except those given again on this command line.
+    question = None
+    if args.resume:
+        run_checkpoint = RunCheckpoint(RUNS_DIR, args.resume)
+        if not run_checkpoint.exists():
+            parser.error(f"there is no run {args.resume} in {RUNS_DIR}")
+        manifest = run_checkpoint.manifest()
+        given = given_options(parser)
+        for name, value in manifest["options"].items():
+            if name not in given and name != "resume":
+                setattr(args, name, value)
+        question = manifest["question"]
+        if question is None:
+            print(f"Resuming batch run {args.resume}: {args.batch}")
+        else:
+            print(f"Resuming run {args.resume}: {question}")
+
+    options = ResearchOptions(extract_mode=args.extract_mode, extract_concurrency=args.extract_concurrency,
+                              merge_concurrency=args.merge_concurrency, score_batch_size=args.score_batch_size,
+                              pool_size=args.pool_size, task_timeout=args.task_timeout,
+                              rank_top_k=args.rank_top_k, rank_min_score=args.rank_min_score)
+
+    if args.no_page_cache:
+        page_fetcher.cache = None
+    llm_slots = threading.BoundedSemaphore(max(1, args.llm_concurrency))
+    if args.no_wiki_cache:
+        wiki_client.cache_path = None
+    if args.no_llm_cache:
+        llm_cache = None
+    if args.trace or args.chrome_trace:
+        tracer.enabled = True
+
+    print(f"Fast model {FAST_MODEL_NAME}:{FAST_MODEL_MAX_TOKENS}")
+    print(f"Smart model {SMART_MODEL_NAME}:{SMART_MODEL_MAX_TOKENS}")
+
+    prices = {}
+    for model_name, variable in ((FAST_MODEL_NAME, "FAST_MODEL_PRICE"), (SMART_MODEL_NAME, "SMART_MODEL_PRICE")):
+        if os.getenv(variable):
+            prices[model_name] = parse_price(os.getenv(variable))
+    budget_limits = dict(max_tokens=args.max_tokens, max_cost=args.max_cost, max_seconds=args.max_time,
+                         max_calls=args.max_llm_calls, prices=prices, reserve=args.budget_reserve,
+                         min_novelty=args.min_novelty, patience=args.novelty_patience)
+
+    if args.batch:
+        if args.stream:
+            parser.error("--stream cannot be used with --batch")
+        if run_checkpoint is None and not args.no_checkpoint:
+            run_checkpoint = RunCheckpoint(RUNS_DIR, new_run_id(args.batch))
+            run_checkpoint.start(None, vars(args))
+            print(f"Run {run_checkpoint.run_id}, resume it with --resume {run_checkpoint.run_id} if interrupted")
+        answered = research_batch(args.batch, args.output, args.web, args.wiki, options, args.batch_concurrency,
+                                  budget_limits)
+        print(f"\n\nBatch complete, {answered} questions answered, saved to {args.output}\n\n")
+    else:
+        if question is None:
+            while True:
+                question = input("Enter your question: ")
+                if question != "":
+                    break
+            if not args.no_checkpoint:
+                run_checkpoint = RunCheckpoint(RUNS_DIR, new_run_id(question))
+                run_checkpoint.start(question, vars(args))
+                print(f"Run {run_checkpoint.run_id}, resume it with --resume {run_checkpoint.run_id} if interrupted")
+
+        budget = ResearchBudget(**budget_limits)
+        if budget.limited:
+            research_budget.set(budget)
+
+        # In streaming mode the result file is named up front, and extracted sources and the answer are written to it
+        # as they arrive.
+        write_answer = None
+        if args.stream:
+            progress = ProgressWriter(result_file_name(question))
+            progress.section("Sources")
+            # Merge attempts can be rejected and retried, so the streamed answer goes to the terminal only, and the
+            # accepted answer is saved to the file at the end.
+            write_answer = progress.writer("Answer", save=False)
+
+        result = research_question(question, args.web, args.wiki, options, on_text=write_answer)
+
+        if progress is not None:
+            if "Answer" not in progress.headings:
+                write_answer(result)
+            progress.save("Answer", result)
+            print(f"\n\nSearch complete, saved to {progress.path}\n\n")
+            progress.close()
+        else:
+            print("Search complete\n\n")
+            print(result)
+    if page_fetcher.cache is not None:
+        print(page_fetcher.cache.report())
+    if llm_cache is not None:
+        print(llm_cache.report())
+    if args.wiki > 0:
+        print(wiki_client.report())
+    print(rate_limiter.report())
+    if not args.batch and research_budget.get() is not None:
+        print(research_budget.get().report())
+    if not args.batch and progress is None:
+        save_to_file(result_file_name(question), result)
+    if run_checkpoint is not None:
+        print(run_checkpoint.report())
+        run_checkpoint.close()
+
+    if tracer.enabled:
+        print(tracer.summary())
+        if args.trace:
+            tracer.export_json(args.trace)
+        if args.chrome_trace:
+            tracer.export_chrome(args.chrome_trace)
 
 
 if __name__ == "__main__":
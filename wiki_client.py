@@ -0,0 +1,183 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+
+API_URL = "https://en.wikipedia.org/w/api.php"
+USER_AGENT = "web-research-agent/1.0 (python-requests)"
+MAX_BATCH_SIZE = 20  # the most intro extracts the API returns for one request
+MAX_SEARCH_RESULTS = 500
+
+WikiSummary = namedtuple("WikiSummary", ["title", "url", "summary"])
+
+
+class WikipediaClient:
+    """
+    Search Wikipedia and fetch page summaries concurrently, with a persistent title -> (url, summary) cache.
+
+    Summaries are the plain text introduction of each page, the same text as `wikipedia.page(title).summary`. They are
+    requested from the MediaWiki API `batch_size` titles per request (up to 20), and no more than `max_workers`
+    requests are in flight at once across every caller of the client. Redirects are followed. Pages that are missing
+    or are disambiguation pages come back as None instead of raising, and are cached as such, so they cost a request
+    only once. Cached entries older than `ttl` seconds are fetched again. Set `cache_path` to None to turn the cache
+    off.
+
+    Example Usage:
+    >>> client = WikipediaClient(".cache/wikipedia.sqlite")
+    >>> titles = client.search("dispersed camping utah")
+    >>> for title, page in client.summaries(titles).items():
+    >>>     if page is not None:
+    >>>         print(page.url, page.summary)
+    """
+
+    def __init__(self, cache_path: str = None, ttl: float = 7 * 86400, max_workers: int = 4,
+                 batch_size: int = MAX_BATCH_SIZE, api_url: str = API_URL, timeout: float = 20):
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.max_workers = max_workers
+        self.batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+        self.api_url = api_url
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._connection = None
+        self._executor = None
+        self._session = requests.Session()
+        self._session.headers["User-Agent"] = USER_AGENT
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(1, max_workers))
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+    def search(self, query: str, limit: int = 10) -> list[str]:
+        """Return the titles of the pages that best match a query, best first."""
+        reply = self._query({"list": "search", "srsearch": query, "srlimit": max(1, min(limit, MAX_SEARCH_RESULTS)),
+                             "srprop": ""})
+        if reply is None:
+            return []
+        return [r["title"] for r in reply.get("query", {}).get("search", [])]
+
+    def summary(self, title: str) -> WikiSummary:
+        """Return the summary of one page, or None when it is missing or a disambiguation page."""
+        return self.summaries([title])[title]
+
+    def summaries(self, titles: list[str]) -> dict:
+        """
+        Return a dict from each title, in the order given, to its `WikiSummary` or None.
+
+        Cached titles are answered from the cache; the rest are fetched in concurrent batches. Titles whose request
+        failed are None and are not cached.
+        """
+        found = {}
+        missing = []
+        for title in dict.fromkeys(titles):
+            cached = self._cached(title)
+            if cached is not None:
+                found[title] = cached[0]
+            else:
+                missing.append(title)
+
+        batches = [missing[i:i + self.batch_size] for i in range(0, len(missing), self.batch_size)]
+        for future in [self._pool().submit(self._fetch, batch) for batch in batches]:
+            found.update(future.result())
+        return {title: found.get(title) for title in dict.fromkeys(titles)}
+
+    def report(self) -> str:
+        return f"Wikipedia cache: {self.hits} hits, {self.misses} misses, {self.requests} API requests"
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self._session.close()
+
+    def _fetch(self, titles: list[str]) -> dict:
+        """Fetch the summaries of up to `batch_size` titles with one API request, and cache them."""
+        reply = self._query({"prop": "extracts|info|pageprops", "exintro": 1, "explaintext": 1,
+                             "exlimit": len(titles), "inprop": "url", "ppprop": "disambiguation", "redirects": 1,
+                             "titles": "|".join(titles)})
+        if reply is None:
+            return {title: None for title in titles}
+
+        query = reply.get("query", {})
+        pages = {}
+        for page in query.get("pages", []):
+            if page.get("missing") or page.get("invalid") or "disambiguation" in page.get("pageprops", {}):
+                pages[page.get("title")] = None
+            else:
+                pages[page["title"]] = WikiSummary(page["title"], page.get("fullurl", ""), page.get("extract", ""))
+
+        # The API answers under the normalized, redirected title; follow that chain back to each title asked for.
+        renamed = {r["from"]: r["to"] for r in query.get("normalized", []) + query.get("redirects", [])}
+        found = {}
+        for title in titles:
+            resolved = title
+            for _ in range(len(renamed) + 1):
+                if resolved not in renamed:
+                    break
+                resolved = renamed[resolved]
+            found[title] = pages.get(resolved)
+        self._store(found)
+        return found
+
+    def _query(self, params: dict) -> dict:
+        params = dict(params, action="query", format="json", formatversion=2)
+        with self._lock:
+            self.requests += 1
+        try:
+            response = self._session.get(self.api_url, params=params, timeout=self.timeout)
+            response.raise_for_status()
+            return response.json()
+        except (requests.RequestException, ValueError) as err:
+            print(f"Wikipedia request failed: {err!r}")
+            return None
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=max(1, self.max_workers))
+            return self._executor
+
+    def _cached(self, title: str) -> tuple:
+        """Return `(summary_or_None,)` for a cached title, or None when it is not cached or expired."""
+        if self.cache_path is None:
+            return None
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT resolved_title, url, summary, fetched_at FROM summaries WHERE title = ?", (title,)).fetchone()
+            if row is None or time.time() - row[3] >= self.ttl:
+                self.misses += 1
+                return None
+            self.hits += 1
+        if row[0] is None:
+            return (None,)
+        return (WikiSummary(row[0], row[1], row[2]),)
+
+    def _store(self, found: dict):
+        if self.cache_path is None:
+            return
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.executemany(
+                "INSERT OR REPLACE INTO summaries (title, resolved_title, url, summary, fetched_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(title, page.title, page.url, page.summary, now) if page is not None
+                 else (title, None, None, None, now) for title, page in found.items()])
+            connection.commit()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            directory = os.path.dirname(self.cache_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.cache_path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS summaries (title TEXT PRIMARY KEY, resolved_title TEXT, url TEXT, "
+                "summary TEXT, fetched_at REAL)")
+            self._connection.commit()
+        return self._connection
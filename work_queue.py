@@ -0,0 +1,120 @@
+import contextvars
+import threading
+import time
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+# The cancel event of the task running in this context, set once the task times out or its queue is cancelled.
+cancel_event = contextvars.ContextVar("cancel_event", default=None)
+
+
+def task_cancelled() -> bool:
+    """Whether the work queue task this code runs in has timed out or been cancelled, so it should stop early."""
+    event = cancel_event.get()
+    return event is not None and event.is_set()
+
+
+class TaskTimeout(Exception):
+    """Raised from the future of a task that ran longer than the queue's task timeout."""
+
+
+class WorkQueue:
+    """
+    A pool of worker threads fed from one shared queue of tasks.
+
+    Idle workers take the next task from the queue, so a slow task only holds up its own worker. Tasks can be
+    submitted while results are being consumed, which lets one stage hand its output straight to the next. A task that
+    runs longer than `task_timeout` seconds is reported as failed with `TaskTimeout` and its result is ignored. `cancel()`
+    drops every task that has not started yet. Python cannot stop a running thread, so a task that times out or is
+    running when the queue is cancelled is asked to stop instead: `task_cancelled()` turns True in it, and long tasks
+    check it between steps. Tasks run in a copy of the context they were submitted from, so they see its context
+    variables.
+
+    Example Usage:
+    >>> with WorkQueue(max_workers=4, task_timeout=300) as queue:
+    >>>     for i, url in enumerate(urls):
+    >>>         queue.submit(fetch, url, key=i)
+    >>>     for key, future in queue.as_completed():
+    >>>         print(key, future.result())
+    """
+
+    def __init__(self, max_workers: int = 4, task_timeout: float = None):
+        self.max_workers = max(1, int(max_workers))
+        self.task_timeout = task_timeout if task_timeout and task_timeout > 0 else None
+        self.cancelled = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self._lock = threading.Lock()
+        self._tasks = {}
+
+    def submit(self, fn, *args, key=None, **kwargs) -> Future:
+        """Queue `fn(*args, **kwargs)`; `key` is returned with its future by `as_completed`."""
+        if self.cancelled.is_set():
+            raise CancelledError("The work queue has been cancelled.")
+        started = {}
+        event = threading.Event()
+        context = contextvars.copy_context()
+        context.run(cancel_event.set, event)
+
+        def run():
+            if self.cancelled.is_set():
+                raise CancelledError("The work queue has been cancelled.")
+            started["at"] = time.monotonic()
+            return context.run(fn, *args, **kwargs)
+
+        future = self._executor.submit(run)
+        with self._lock:
+            self._tasks[future] = (key, started, event)
+        return future
+
+    def as_completed(self):
+        """
+        Yield `(key, future)` for every task as it finishes, including tasks submitted during the iteration.
+
+        A task that times out is yielded with a future that raises `TaskTimeout`.
+        """
+        tick = min(1.0, self.task_timeout) if self.task_timeout else None
+        while True:
+            with self._lock:
+                pending = set(self._tasks)
+            if not pending:
+                return
+            done, _ = wait(pending, timeout=tick, return_when=FIRST_COMPLETED)
+            for future in done:
+                with self._lock:
+                    key, _, _ = self._tasks.pop(future)
+                yield key, future
+            for key, future in self._expired():
+                yield key, future
+
+    def cancel(self):
+        """Stop starting new tasks, drop every task that is still queued, and ask running tasks to stop."""
+        self.cancelled.set()
+        with self._lock:
+            for future, (_, _, event) in self._tasks.items():
+                event.set()
+                future.cancel()
+
+    def _expired(self) -> list:
+        if not self.task_timeout:
+            return []
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for future, (key, started, event) in list(self._tasks.items()):
+                if "at" in started and not future.done() and now - started["at"] > self.task_timeout:
+                    del self._tasks[future]
+                    event.set()
+                    timed_out = Future()
+                    timed_out.set_exception(TaskTimeout(f"Task {key} ran longer than {self.task_timeout}s."))
+                    expired.append((key, timed_out))
+        return expired
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.cancel()
+        # Timed out tasks may still be running until they next check task_cancelled(); let them stop in the background.
+        self._executor.shutdown(wait=False, cancel_futures=exc_type is not None)
+        return False